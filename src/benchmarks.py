@@ -0,0 +1,619 @@
+"""
+Benchmarks for the data reduction routines. Each benchmark runs the
+current routine against a copy of the routine it replaced on synthetic
+data and prints the time taken by both along with whether the outputs
+match.
+
+Usage:
+    python benchmarks.py            # runs every benchmark
+    python benchmarks.py std_dev    # runs the benchmarks named
+"""
+import os
+import sys
+import time
+import tempfile
+import tracemalloc
+# Third party packages
+import numpy as np
+# Custom packages
+import formatdata
+import correctrotation
+
+
+def timeit(func, *args, repeat=3, **kwargs):
+    """Returns the best run time of func and its output"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = func(*args, **kwargs)
+        took = time.perf_counter() - start
+        best = took if best is None else min(best, took)
+    return best, out
+
+def report(name, old, new, same):
+    """Prints one benchmark line"""
+    print('%-28s old %9.4fs  new %9.4fs  x%7.1f  match: %s'
+          %(name, old, new, old/new if new else float('inf'), same))
+
+def synthetic_hour(samp_freq, spikes=50, seed=0):
+    """
+    Creates an hour of magnetometer like data, a random walk around
+    a field value with a few spikes added
+    """
+    rng = np.random.default_rng(seed)
+    size = samp_freq * 60 * 60
+    data = 17593.342 + np.cumsum(rng.normal(0, .01, size))
+    data[rng.integers(0, size, spikes)] += rng.normal(0, 5, spikes)
+    return data
+
+#----LEGACY ROUTINES----#
+
+def legacy_data_pipeline(raw, samp_freq, smooth=10):
+    """
+    The Data methods graph.plot() runs on an hour while raw and data
+    were lists of four arrays: fstar, make_smooth, make_rate_change,
+    make_variance
+    """
+    data = raw.copy()
+    data[3] = np.sqrt(data[0]**2 + data[1]**2 + data[2]**2)
+    width = smooth * samp_freq
+    for iterate in range(len(data)):
+        data[iterate] = np.convolve(data[iterate], np.ones(width)/width,
+                                    mode='valid')
+        raw[iterate] = raw[iterate][int(width/2):-int(width/2)+1]
+    roc = [0, 0, 0, 0]
+    avg = [0, 0, 0, 0]
+    for iterate in range(len(data)):
+        roc[iterate] = np.zeros(len(data[iterate]))
+        for check_time in range(1, len(data[iterate]) - 1):
+            roc[iterate][check_time] = ((data[iterate][check_time] -
+                                         data[iterate][check_time-1]) *
+                                        samp_freq)
+    for iterate in range(len(data)):
+        avg[iterate] = np.mean(data[iterate])
+        data[iterate] = data[iterate] - avg[iterate]
+    return data, roc, avg
+
+def legacy_get_std_dev(raw_data, smooth_data, samp_freq, sigma=4.0):
+    """formatdata.get_std_dev before it was vectorized"""
+    seperation = raw_data - smooth_data
+    std = np.std(seperation)
+    return np.array([
+        [np.nan, np.nan],
+        *[(num / samp_freq / 60, raw_data[num])
+          for num in range(len(smooth_data))
+          if ((raw_data[num] > (smooth_data[num] + (sigma*std))) or
+              (raw_data[num] < (smooth_data[num] - (sigma*std))))
+         ]]).transpose()
+
+def legacy_clusters(data):
+    """
+    recordlrt.record_data before it was vectorized, returns the
+    (start, count) of every event instead of writing them
+    """
+    clusters = []
+    while np.any(data):
+        time_start = data[0]
+        time_now = time_start
+        count = 1
+        for iterate in range(1, len(data)):
+            if data[iterate] <= (time_now + 1.5):
+                count += 1
+                time_now = data[iterate]
+        clusters.append((time_start, count))
+        for iterate in range(count):
+            if not np.any(data):
+                break
+            data = np.delete(data, 0, 0)
+    return clusters
+
+def legacy_write_vsec(file_name, date, time, data):
+    """The line by line writer rt1hz.py used before write_vsec"""
+    from decimal import Decimal, ROUND_HALF_UP
+
+    with open(file_name, 'w', 1) as data_base:
+        for iterate, time in enumerate(time):
+            time = Decimal(time)
+            time = Decimal(time.quantize(Decimal('.001'),
+                                         rounding=ROUND_HALF_UP))
+            time, mili = divmod(time, 1)
+            minute, second = divmod(time, 60)
+            hour, minute = divmod(minute, 60)
+            hour = hour%24
+            mili = str(mili).split('.')
+            time = "%02d:%02d:%02d:%s" % (hour, minute, second, mili[1])
+            data_base.write('%s-%s-%s %s %s    %s %s %s %s\n'
+                            %(date.y,
+                              date.m,
+                              date.d,
+                              time,
+                              date.j,
+                              '%.2f'%data[0][iterate],
+                              '%.2f'%data[1][iterate],
+                              '%.2f'%data[2][iterate],
+                              '%.2f'%data[3][iterate]))
+
+#----BENCHMARKS----#
+
+def bench_std_dev():
+    """Spike detection over one hour of one channel"""
+    for samp_freq in [32, 100]:
+        raw = synthetic_hour(samp_freq)
+        width = 10 * samp_freq
+        smooth = np.convolve(raw, np.ones(width)/width, mode='valid')
+        raw = raw[int(width/2):-int(width/2)+1]
+
+        old, expected = timeit(legacy_get_std_dev, raw, smooth, samp_freq)
+        new, result = timeit(formatdata.get_std_dev, raw, smooth, samp_freq)
+        report('get_std_dev %sHz'%(samp_freq), old, new,
+               np.array_equal(expected, result, equal_nan=True))
+
+def bench_clusters():
+    """Event clustering of the spikes of a noisy hour"""
+    import recordlrt
+
+    rng = np.random.default_rng(0)
+    # Bursts of spikes a few seconds apart with quiet gaps between them
+    times = np.sort(np.hstack([start + rng.uniform(0, 2, 400)
+                               for start in np.arange(0, 60, 4.)]))
+    spikes = np.hstack(([np.nan], times))
+
+    old, expected = timeit(legacy_clusters, spikes, repeat=1)
+    new, events = timeit(recordlrt.cluster_events, spikes)
+    expected = [(start, count) for start, count in expected
+                if count >= 99]
+    result = [(event['start'], event['count'])
+              for event in events[events['count'] >= 99]]
+    report('cluster_events', old, new, expected == result)
+
+def bench_write_vsec():
+    """Writing a day of 1hz data"""
+
+    date = formatdata.Date(0)
+    rng = np.random.default_rng(0)
+    # 1hz samples taken from 100hz times carry float error, a few sit
+    # exactly on half a millisecond
+    time = np.arange(86400) + rng.integers(0, 100, 86400) / 100
+    time[::1000] += .0005
+    data = [synthetic_hour(24, seed=axis) for axis in range(4)]
+
+    with tempfile.TemporaryDirectory() as temp:
+        old_file = os.path.join(temp, 'old.sec')
+        new_file = os.path.join(temp, 'new.sec')
+        old, _ = timeit(legacy_write_vsec, old_file, date, time, data,
+                        repeat=1)
+        new, _ = timeit(formatdata.write_vsec, new_file, date, time, data)
+        with open(old_file, 'rb') as old_bytes:
+            with open(new_file, 'rb') as new_bytes:
+                same = old_bytes.read() == new_bytes.read()
+    report('write_vsec', old, new, same)
+
+def compare_decimation(data, factor, filt_freq, samp_freq, edge=600):
+    """
+    Regression harness for MakeData.filtsample(method='polyphase').
+    Decimates data with the butter_low_pass path and the polyphase path
+    and returns how far apart they are, ignoring edge output samples at
+    each end where both filters have transients
+
+    Returns:
+    -------
+        dict: max and rms difference, time taken by each path
+    """
+    old, expected = timeit(
+        lambda: formatdata.butter_low_pass(data, filt_freq,
+                                           samp_freq)[::factor],
+        repeat=1)
+    new, result = timeit(formatdata.polyphase_decimate, data, factor,
+                         filt_freq, samp_freq, repeat=1)
+    diff = (expected - result)[edge:-edge]
+    return {'max': np.max(np.abs(diff)),
+            'rms': np.sqrt(np.mean(diff**2)),
+            'old': old,
+            'new': new}
+
+def bench_decimation():
+    """Filtering 26 hours down to 1hz like rt1hz"""
+    for samp_freq in [100, 32]:
+        hours = 26
+        data = np.hstack([synthetic_hour(samp_freq, seed=hour)
+                          for hour in range(hours)])
+        stats = compare_decimation(data, samp_freq, .5, samp_freq)
+        report('polyphase %sHz'%(samp_freq), stats['old'], stats['new'],
+               'max %.4f nT rms %.4f nT'%(stats['max'], stats['rms']))
+
+    freq, response = formatdata.polyphase_response(100, .5, 100)
+    print('%-28s %s'%('anti-alias 100Hz -> 1Hz',
+                      ', '.join('%.2fHz %.1fdB'%(f, 20*np.log10(
+                          max(response[np.argmin(np.abs(freq - f))],
+                              1e-12)))
+                                for f in [.1, .4, .5, .6, 1, 10])))
+
+def peak_memory(func, *args, **kwargs):
+    """Returns the peak memory allocated while running func"""
+    tracemalloc.start()
+    try:
+        func(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def bench_chunked():
+    """
+    Regression harness for chunked_low_pass. Filters 26 hours of 100hz
+    in memory with butter_low_pass and a chunk at a time, checks the
+    two agree away from the edges and compares their peak memory
+    """
+    samp_freq, edge = 100, 600*100
+    data = np.hstack([synthetic_hour(samp_freq, seed=hour)
+                      for hour in range(26)])
+    old, expected = timeit(formatdata.butter_low_pass, data, .5,
+                           samp_freq, repeat=1)
+    new, result = timeit(formatdata.chunked_low_pass, data, .5, samp_freq,
+                         repeat=1)
+    diff = np.max(np.abs(expected - result)[edge:-edge])
+    report('chunked 100Hz', old, new, 'max %.2e nT'%(diff))
+
+    old = peak_memory(formatdata.butter_low_pass, data, .5, samp_freq)
+    new = peak_memory(formatdata.chunked_low_pass, data, .5, samp_freq,
+                      step=samp_freq)
+    print('%-28s old %7.1fMB  new %7.1fMB  (input %.1fMB)'
+          %('chunked peak memory', old/1024**2, new/1024**2,
+            data.nbytes/1024**2))
+
+def cache_size(directory):
+    """Returns the bytes held under directory"""
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, files in os.walk(directory) for name in files)
+
+def bench_cache():
+    """
+    TdmsCache against decoding with TdmsFile.read on hours of 32hz
+    files, in a cache with room for two and a half of them so every
+    new hour evicts one. Checks the cache never grows past max_size,
+    including for a file too big to be kept at all
+    """
+    from nptdms import TdmsFile, TdmsWriter, ChannelObject
+
+    samp_freq, hours = 32, 5
+    with tempfile.TemporaryDirectory() as temp:
+        paths = []
+        for hour in range(hours + 1):
+            # the last file holds three hours, more than the cache
+            length = 3 if hour == hours else 1
+            data = [synthetic_hour(samp_freq, seed=hour*4 + seed)
+                    for seed in range(4)]
+            path = os.path.join(temp, 'LRE20200425_%02d.tdms'%(hour))
+            with TdmsWriter(path) as tdms:
+                tdms.write_segment(
+                    [ChannelObject('v32Hz', 'channel %s'%(channel + 1),
+                                   np.tile(data[channel], length))
+                     for channel in range(4)] +
+                    [ChannelObject('v32Hz', 'sec of day',
+                                   np.arange(len(data[0])*length) /
+                                   samp_freq)])
+            paths.append(path)
+
+        size = 5 * 128 + 5 * 8 * samp_freq * 3600 # one hour of blocks
+        cache_dir = os.path.join(temp, 'cache')
+        os.makedirs(cache_dir)
+        cache = formatdata.TdmsCache(cache_dir, int(size * 2.5))
+        largest = 0
+        for path in paths[:hours]:
+            old, expected = timeit(TdmsFile.read, path)
+            cold, _ = timeit(cache.read, path, 'v32Hz', repeat=1)
+            largest = max(largest, cache_size(cache_dir))
+            new, found = timeit(cache.read, path, 'v32Hz')
+            largest = max(largest, cache_size(cache_dir))
+        report('cache 32Hz hour cold', old, cold, 'decoded and stored')
+        report('cache 32Hz hour warm', old, new, all(
+            np.array_equal(expected['v32Hz'][name].data,
+                           found['v32Hz'][name].data)
+            for name in found['v32Hz']))
+
+        found = cache.read(paths[-1], 'v32Hz')
+        largest = max(largest, cache_size(cache_dir))
+        assert largest <= cache.max_size, (largest, cache.max_size)
+        print('%-28s largest %.1fMB of max %.1fMB, %s of %s hours kept, '
+              'too big file read %s samples'
+              %('cache size', largest/1024**2, cache.max_size/1024**2,
+                sum(os.path.isdir(os.path.join(cache_dir, cache.key(path)))
+                    for path in paths[:hours]), hours,
+                len(found['v32Hz']['channel 1'].data)))
+
+def synthetic_data(samp_freq, dtype=np.float64):
+    """A formatdata.Data holding an hour of synthetic x y z f"""
+    data = formatdata.Data.__new__(formatdata.Data)
+    data.samp_freq = samp_freq
+    data.dtype = dtype
+    data.raw = np.array([synthetic_hour(samp_freq, seed=seed)
+                         for seed in range(4)], dtype=dtype)
+    data.ppm = data.raw[3]
+    data.data = data.raw.copy()
+    data.time = np.arange(data.raw.shape[1]) / samp_freq / 60
+    data.Fstar = None
+    return data
+
+def data_pipeline(data, smooth=10):
+    """The Data methods graph.plot() runs on an hour"""
+    data.fstar()
+    data.make_smooth(smooth)
+    data.make_rate_change()
+    data.make_variance()
+    return data
+
+def bench_data_arrays():
+    """
+    Data methods on a (4, samples) array against the list of four
+    arrays they replaced, timed and with their peak memory
+    """
+    samp_freq = 32
+    raw = list(synthetic_data(samp_freq).raw)
+    old, expected = timeit(lambda: legacy_data_pipeline(list(raw),
+                                                        samp_freq),
+                           repeat=1)
+    old_peak = peak_memory(legacy_data_pipeline, list(raw), samp_freq)
+    for dtype in [np.float64, np.float32]:
+        new = min(timeit(data_pipeline, synthetic_data(samp_freq, dtype),
+                         repeat=1)[0] for _ in range(3))
+        result = synthetic_data(samp_freq, dtype)
+        new_peak = peak_memory(data_pipeline, result)
+        data = np.max(np.abs(np.asarray(expected[0]) - result.data))
+        roc = np.max(np.abs(np.asarray(expected[1]) - result.roc))
+        report('Data %s'%(np.dtype(dtype).name), old, new,
+               'data %.1e nT roc %.1e nT/s, peak %.1fMB -> %.1fMB'
+               %(data, roc, old_peak/1024**2, new_peak/1024**2))
+
+def bench_smooth():
+    """make_smooth on an hour of all four channels, 10s and 60s windows,
+    then one channel with a nan in it"""
+    for samp_freq in [32, 100]:
+        data = np.array([synthetic_hour(samp_freq, seed=seed)
+                         for seed in range(4)])
+        for seconds in [10, 60]:
+            width = seconds * samp_freq
+            old, expected = timeit(
+                lambda: np.array([np.convolve(channel,
+                                              np.ones(width)/width,
+                                              mode='valid')
+                                  for channel in data]))
+            new, result = timeit(formatdata.moving_average, data, width)
+            report('smooth %sHz %ss'%(samp_freq, seconds), old, new,
+                   'max %.1e nT'%(np.max(np.abs(expected - result))))
+
+    # A missing sample should only blank the windows it is in
+    data = synthetic_hour(32)
+    data[len(data)//2] = np.nan
+    expected = np.convolve(data, np.ones(320)/320, mode='valid')
+    result = formatdata.moving_average(data, 320)
+    print('%-28s %s of %s nan (convolve %s), max %.1e nT'
+          %('smooth 32Hz 10s nan', np.isnan(result).sum(), len(result),
+            np.isnan(expected).sum(), np.nanmax(np.abs(expected - result))))
+
+def bench_align():
+    """
+    align_times against the np.rint matching add_f used, on a day of
+    1hz times that line up index for index, then with a gap and a
+    repeated stretch in the ppm times that the old matching can not
+    handle
+    """
+    rng = np.random.default_rng(0)
+    xyz = np.arange(86400) + rng.uniform(-.2, .2, 86400)
+    ppm = np.arange(86400) + rng.uniform(-.2, .2, 86400)
+    old, expected = timeit(
+        lambda: np.nonzero(np.rint(xyz) == np.rint(ppm[:86400]))[0])
+    new, found = timeit(formatdata.align_times, xyz, ppm)
+    report('align_times', old, new,
+           np.array_equal(np.nonzero(found >= 0)[0], expected) and
+           np.array_equal(found[expected], expected))
+
+    broken = np.hstack((ppm[:40000], ppm[39000:40000], ppm[41000:]))
+    found = formatdata.align_times(xyz, broken)
+    matched = found >= 0
+    print('%-28s %s of %s matched, max %.2fs apart'
+          %('align_times gaps', matched.sum(), len(xyz),
+            np.max(np.abs(xyz[matched] - broken[found[matched]]))))
+
+    # A vsec.sec missing its first three hours still pairs each second
+    # with the same second of the OTT file
+    with tempfile.TemporaryDirectory() as temp:
+        ott_file = os.path.join(temp, 'OTT2020116.sec')
+        lrt_file = os.path.join(temp, 'LRE20200425vsec.sec')
+        with open(ott_file, 'w') as ott:
+            ott.writelines('OTT 2020 116:%02d:%02d:%02d %s 0.00 0.00 0.00\n'
+                           %(sec//3600, sec%3600//60, sec%60, sec)
+                           for sec in range(86400))
+        with open(lrt_file, 'w') as lrt:
+            lrt.writelines('2020-04-25 %02d:%02d:%02d:000 116 %s 0.00 0.00 '
+                           '0.00\n'%(sec//3600, sec%3600//60, sec%60, sec)
+                           for sec in range(3*3600, 86400))
+        ott_time, ott_data = formatdata.read_ascii_data(ott_file, 'sec')
+        lrt_time, lrt_data = formatdata.read_ascii_data(lrt_file, 'secNew')
+    found = formatdata.align_times(lrt_time, ott_time)
+    matched = found >= 0
+    print('%-28s %s of %s matched, same second: %s'
+          %('align_times late start', matched.sum(), len(lrt_time),
+            np.array_equal(lrt_data[0][matched],
+                           ott_data[0][found[matched]])))
+
+def bench_gaps():
+    """
+    TimeSeries.gaps on a day of 100hz missing two hours against finding
+    them a step at a time, then on a MakeData that no file was added to
+    as rt1hz.py has for a station with no data
+    """
+    samp_freq = 100
+    time = np.arange(86400 * samp_freq) / samp_freq
+    time = np.hstack((time[:3600*samp_freq], time[5*3600*samp_freq:],
+                      time[-1] + 1 + time[:3600*samp_freq]))
+    series = formatdata.TimeSeries(time, np.empty((4, len(time))),
+                                   samp_freq)
+
+    def legacy():
+        return [(iterate, time[iterate - 1], time[iterate])
+                for iterate in range(1, len(time))
+                if time[iterate] - time[iterate - 1] > 1.5 / samp_freq]
+    old, expected = timeit(legacy, repeat=1)
+    new, found = timeit(series.gaps)
+    report('gaps 100Hz day', old, new, found.tolist() == expected)
+
+    empty = formatdata.MakeData()
+    assert len(empty.gaps()) == 0
+    assert empty.gaps().dtype == formatdata.GAP_DTYPE
+    single = formatdata.TimeSeries(time[:1], np.empty((4, 1)), samp_freq)
+    assert len(single.gaps()) == 0
+    print('%-28s empty MakeData %s gaps, one sample %s gaps'
+          %('gaps no data', len(empty.gaps()), len(single.gaps())))
+
+def plot_data(samp_freq):
+    """The lrt and ott Data graph.plot() draws for an hour of samp_freq
+    data, after the same methods it runs"""
+    lrt = synthetic_data(samp_freq)
+    lrt.fstar()
+    lrt.make_smooth(10)
+    lrt.get_spikes(sigma=4.0)
+    lrt.make_rate_change()
+    lrt.make_variance()
+    ott = synthetic_data(1)
+    ott.fstar()
+    ott.make_variance()
+    return lrt, ott
+
+def legacy_plot(graph, path, lrt, ott):
+    """The figure graph.plot() made from scratch for each hour plot"""
+    plt = graph.plt
+    axis = graph.AxisGet('v32Hz')
+    names = ['X', 'Y', 'Z', 'F*', 'F-F*']
+    fig, axes = plt.subplots(4, figsize=(15, 15))
+    fig.text(.5, .04, 'Time(Min)', ha='center', va='center')
+    fig.suptitle('LRE 2020/04/25 Hour 0300 32Hz Data', fontsize=20)
+    for k in range(4):
+        axtwn = axes[k].twinx()
+        axtwn.plot(lrt.time, lrt.roc[k], 'r-', label='Rate of Change',
+                   alpha=.3)
+        axes[k].plot(lrt.time, lrt.data[k], 'b-',
+                     label='LRE Data {}'.format(lrt.avg[k]))
+        axes[k].plot(ott.time, ott.data[k], 'c-',
+                     label='OTT Data {}'.format(ott.avg[k]))
+        axes[k].plot(lrt.spikes[k][0], lrt.spikes[k][1]-lrt.avg[k],
+                     'gx', markersize=10, alpha=.75)
+    for k in range(4):
+        axis.yaxis(lrt.data[k], ott.data[k])
+        axes[k].set_yticks(axis.y_tick)
+        axes[k].set_ylim([-axis.y_max, axis.y_max])
+        axes[k].set_xticks(axis.x_major)
+        axes[k].set_xticks(axis.x_minor, minor=True)
+        axes[k].grid(which='both')
+        axes[k].set_ylabel('%s variance (nT)'%(names[k]))
+        axes[k].legend(loc=2, prop={'size':12})
+    plt.tight_layout()
+    fig.subplots_adjust(top=0.88)
+    plt.savefig(path, format='png')
+    plt.close('all')
+
+def template_plot(graph, path, lrt, ott):
+    """The same figure drawn through graph.figure_template()"""
+    template = graph.figure_template('v32Hz', 4, (15, 15))
+    template.draw('LRE 2020/04/25 Hour 0300 32Hz Data', lrt, ott,
+                  'LRE Data {}', 'OTT Data {}')
+    template.save(path, 'png')
+
+def bench_figures():
+    """
+    An hour plot made from a new figure each time against one drawn
+    into a figure template, with how many pixels of the two pngs differ
+    """
+    import graph # reads the config and logging setup of the scripts
+    lrt, ott = plot_data(32)
+    with tempfile.TemporaryDirectory() as temp:
+        old_file = os.path.join(temp, 'old.png')
+        new_file = os.path.join(temp, 'new.png')
+        old, _ = timeit(legacy_plot, graph, old_file, lrt, ott)
+        # the first plot builds the template
+        new, _ = timeit(template_plot, graph, new_file, lrt, ott)
+        before = graph.plt.imread(old_file)
+        after = graph.plt.imread(new_file)
+    report('hour plot', old, new,
+           '%.2f%% of pixels differ'%(100*np.mean(np.any(before != after,
+                                                          axis=-1))))
+
+def synthetic_rotation(angles, noise=.5, seed=0):
+    """
+    A day of 1hz OTT like x y z and the same field as seen by a sensor
+    turned by angles (dec, inc, anc) with noise added
+
+    :returns: (data, reference), data rotated by angles matches reference
+    """
+    rng = np.random.default_rng(seed)
+    reference = (np.array(correctrotation.CURRENT_OFFSET)[:, None] +
+                 np.cumsum(rng.normal(0, .3, (3, 86400)), axis=1))
+    rotation = correctrotation.create_rot_deg(*angles)
+    data = rotation @ reference + rng.normal(0, noise, (3, 86400))
+    return data, reference
+
+def bench_rotation():
+    """
+    The closed form rotation fit against the angle by angle search it
+    replaced, with how far each is from the angles used and the root
+    mean square left between the rotated data and the reference
+    """
+    angles = [.012, -.021, .004]
+    data, reference = synthetic_rotation(angles)
+    old, searched = timeit(correctrotation.search_best_tri_rot, data,
+                           reference, .1, repeat=1)
+    new, fitted = timeit(correctrotation.find_best_tri_rot, data,
+                         reference, .1)
+    report('rotation fit', old, new, 'see below')
+    for name, found in [('search', searched), ('fit', fitted)]:
+        rotated = correctrotation.rotate_by_deg(data, *found).transpose()
+        print('%-28s angle error %.1e rad  rms %.3f nT'
+              %('rotation ' + name,
+                np.max(np.abs(np.subtract(found, angles))),
+                np.sqrt(np.mean((rotated - reference)**2))))
+
+def bench_scalar():
+    """
+    The golden section scalar against the .001 step search it replaced,
+    for gains near and far from 1, with the range of the difference
+    each leaves (smaller is better) and the least squares gains
+    """
+    rng = np.random.default_rng(0)
+    offset = np.array(correctrotation.CURRENT_OFFSET)[:, None]
+    reference = offset + np.cumsum(rng.normal(0, .3, (3, 86400)), axis=1)
+    for gains in [[1.0005, 1., 1.], [1.05, .97, 1.002], [1.2, .8, 1.1]]:
+        data = ((reference - offset) / np.array(gains)[:, None] + offset +
+                rng.normal(0, .05, (3, 86400)))
+        found = {}
+        for name, func in [('old', correctrotation.search_best_scalar),
+                           ('new', correctrotation.find_best_scalar)]:
+            found[name] = timeit(lambda: func(data.copy(), reference.copy()))
+        lsq = correctrotation.find_best_scalar(data.copy(), reference.copy(),
+                                               method='lsq')
+        ranges = [[correctrotation.calc_range_dif(data[axis]*scalar[axis],
+                                                  reference[axis])
+                   for axis in range(3)]
+                  for scalar in (found['old'][1], found['new'][1])]
+        report('scalar %s'%(gains), found['old'][0], found['new'][0],
+               'range %.4f -> %.4f nT'%(max(ranges[0]), max(ranges[1])))
+        print('%-28s old %s  new %s  lsq %s'
+              %('', np.round(found['old'][1], 5), np.round(found['new'][1], 5),
+                np.round(lsq, 5)))
+
+BENCHMARKS = {
+    'std_dev': bench_std_dev,
+    'clusters': bench_clusters,
+    'write_vsec': bench_write_vsec,
+    'decimation': bench_decimation,
+    'chunked': bench_chunked,
+    'cache': bench_cache,
+    'data_arrays': bench_data_arrays,
+    'smooth': bench_smooth,
+    'align': bench_align,
+    'gaps': bench_gaps,
+    'figures': bench_figures,
+    'rotation': bench_rotation,
+    'scalar': bench_scalar,
+    }
+
+if __name__ == '__main__':
+    for name in (sys.argv[1:] or BENCHMARKS):
+        BENCHMARKS[name]()
@@ -7,10 +7,11 @@ import argparse
 import os.path
 # Third party packages
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 from matplotlib.colors import LogNorm
+# Custom packages
+from formatdata import read_ascii_data, align_times
 
 CURRENT_OFFSET = [17593.342, -4278.744, 50860.816]
 USER = os.path.expanduser('~')
@@ -305,11 +306,60 @@ def rotate_by_deg(data1, dec, inc, anc=0, plot=False, ref_data=None,
         else:
             return data1.transpose()
 
-def find_best_tri_rot(data1, data2, inc_size, return_rotated=False):
+def find_best_tri_rot(data1, data2, inc_size=None, return_rotated=False):
     """
     Given two data sets it will return either best rotation to match
     the other data set or return the rotated data that best matches
 
+    The rotation is the one with the least squared difference between
+    the rotated data1 and data2 (the Kabsch solution). It is worked out
+    from the 3x3 matrix of data1 against data2 by a singular value
+    decomposition, so the data is only gone over once. Neither data set
+    is centred since the field is rotated about zero.
+
+    :type data1: numpy array
+    :param data1: the data set that will be rotated
+    :type data2: numpy array
+    :param data2: the ideal data set we want to model
+    :type inc_size: float
+    :param inc_size: not used, kept so it can be called like
+                     search_best_tri_rot
+    :type return_rotated: Boolean
+    :param return_rotated: returns rotated data if True
+                           returns rotation if False
+
+    :rtype: list of float or numpy array
+    :returns: [dec, inc, anc] in radians as create_rot_deg takes them
+              or the rotated data
+    """
+    raw = np.asarray(data1[:3], dtype=np.float64)
+    ref = np.asarray(data2[:3], dtype=np.float64)
+
+    # raw.T @ rotation is compared to ref.T, the best rotation is the
+    # one closest to the cross covariance of the two
+    left, _, right = np.linalg.svd(raw @ ref.T)
+    flip = np.sign(np.linalg.det(left @ right))
+    rotation = left @ np.diag([1., 1., flip]) @ right
+
+    # create_rot_deg(dec, inc, anc) is rotation about z, then y, then x
+    best_rotation = [np.arctan2(rotation[1, 0], rotation[0, 0]),
+                     np.arcsin(np.clip(-rotation[2, 0], -1, 1)),
+                     np.arctan2(rotation[2, 1], rotation[2, 2])]
+
+    if return_rotated:
+        return rotate_by_deg(data1, best_rotation[0],
+                             best_rotation[1], best_rotation[2]).transpose()
+
+    return best_rotation
+
+def search_best_tri_rot(data1, data2, inc_size, return_rotated=False):
+    """
+    Given two data sets it will return either best rotation to match
+    the other data set or return the rotated data that best matches
+
+    Searches one angle at a time, halving the step when nothing
+    improves. Replaced by find_best_tri_rot, kept to compare against.
+
     :type data1: numpy array
     :param data1: the data set that will be rotated
     :type data2: numpy array
@@ -381,12 +431,142 @@ def find_best_tri_rot(data1, data2, inc_size, return_rotated=False):
 
     return best_rotation
 
-def find_best_scalar(data1, data2, return_scaled=False):
+def min_range_scalar(data1, data2, tol=1e-9, max_iter=100):
+    """
+    Finds the scalar of each axis that gives the smallest range of
+    data2 - scalar*data1. The range only grows either side of its
+    smallest value so a golden section search finds it.
+
+    Once the scalar is bracketed only the points that can be the
+    highest or lowest of the difference somewhere in the bracket are
+    kept, usually a handful, so the data is only gone over a few times
+    and the search itself is bounded by max_iter.
+
+    :type data1: (3, N) np.array
+    :param data1: data to be rescaled
+    :type data2: (3, N) np.array
+    :param data2: data to be remodled as
+    :type tol: float
+    :param tol: width the scalar is narrowed down to
+    :type max_iter: int
+    :param max_iter: most steps taken
+
+    :rtype: (3,) np.array
+    """
+    def range_of(scalar):
+        """Range of data2 - scalar*data1 for the scalar of each axis"""
+        return np.ptp(data2 - scalar[:, None]*data1, axis=1)
+
+    # Start around the least squares scalar, widening until the range
+    # is bigger at both ends than in the middle
+    centre = lsq_scalar(data1, data2)
+    middle = range_of(centre)
+    step = np.full(3, .001)
+    for _ in range(60):
+        wide = ((range_of(centre - step) < middle) |
+                (range_of(centre + step) < middle))
+        if not wide.any():
+            break
+        step[wide] *= 2
+
+    ratio = (np.sqrt(5) - 1) / 2
+    best = np.empty(3)
+    for axis in range(3):
+        low, high = centre[axis] - step[axis], centre[axis] + step[axis]
+        # The difference of each point is a line in the scalar, one
+        # that is below another line at both ends is never the highest
+        at_low = data2[axis] - low*data1[axis]
+        at_high = data2[axis] - high*data1[axis]
+        top = np.maximum(at_low, at_high)
+        bottom = np.minimum(at_low, at_high)
+        keep = (top >= bottom.max()) | (bottom <= top.min())
+        scaled, ref = data1[axis][keep], data2[axis][keep]
+
+        def range_at(scalar):
+            """Range of the kept points at scalar"""
+            return np.ptp(ref - scalar*scaled)
+
+        left, right = high - ratio*(high - low), low + ratio*(high - low)
+        left_range, right_range = range_at(left), range_at(right)
+        for _ in range(max_iter):
+            if high - low < tol:
+                break
+            if left_range < right_range:
+                high, right, right_range = right, left, left_range
+                left = high - ratio*(high - low)
+                left_range = range_at(left)
+            else:
+                low, left, left_range = left, right, right_range
+                right = low + ratio*(high - low)
+                right_range = range_at(right)
+        best[axis] = (low + high) / 2
+    return best
+
+def lsq_scalar(data1, data2):
+    """
+    Scalar of each axis that gives the least squared difference between
+    scalar*data1 and data2, allowing a constant difference as the range
+    does. An axis that does not change is left at 1
+
+    :rtype: (3,) np.array
+    """
+    data1 = data1 - data1.mean(axis=1, keepdims=True)
+    data2 = data2 - data2.mean(axis=1, keepdims=True)
+    power = np.einsum('ij,ij->i', data1, data1)
+    return np.divide(np.einsum('ij,ij->i', data1, data2), power,
+                     out=np.ones(3), where=power > 0)
+
+def find_best_scalar(data1, data2, return_scaled=False, method='range'):
     """
     Attempts to find the best scalar to multiply by the data1 to represent
     data2. Removes offset as the data was originally measured as only the offset
     so that is what we want to scale
 
+    :type data1: nparray
+    :param data1: data to be rescaled
+    :type data2: nparray
+    :param data2: data to be remodled as
+    :type return_best: Boolean
+    :param return_best: return the rescalled data if true
+                        return the scallars if False
+    :type method: str
+    :param method: 'range' for the smallest range of the difference as
+                   the search found, 'lsq' for the least squared difference
+    """
+    if method not in ('range', 'lsq'):
+        raise ValueError('method must be range or lsq not %s'%(method))
+    for axis in range(3):
+        data1[axis] = data1[axis] - CURRENT_OFFSET[axis]
+        data2[axis] = data2[axis] - CURRENT_OFFSET[axis]
+
+    # Scaling about the offset only moves data1 by a constant from
+    # scaling it about zero, neither changes the range
+    raw = np.array(data1[:3], dtype=np.float64)
+    ref = np.array(data2[:3], dtype=np.float64)
+    if method == 'lsq':
+        best_scalar = list(lsq_scalar(raw, ref))
+    else:
+        best_scalar = list(min_range_scalar(
+            raw - raw.mean(axis=1, keepdims=True),
+            ref - ref.mean(axis=1, keepdims=True)))
+
+    # Return either the scalar or the scaled data
+    if return_scaled:
+        for axis in range(3):
+            data1[axis] = data1[axis]*best_scalar[axis] + CURRENT_OFFSET[axis]
+        return data1[:3]
+
+    return best_scalar
+
+def search_best_scalar(data1, data2, return_scaled=False):
+    """
+    Attempts to find the best scalar to multiply by the data1 to represent
+    data2. Removes offset as the data was originally measured as only the offset
+    so that is what we want to scale
+
+    Steps each scalar by .001 while the range improves. Replaced by
+    find_best_scalar, kept to compare against.
+
     :type data1: nparray
     :param data1: data to be rescaled
     :type data2: nparray
@@ -504,20 +684,18 @@ def main():
         all_files1.append(args.dir1+file1)
         all_files2.append(args.dir2+file2)
 
-    df_from_each_file = (pd.read_fwf(
-        f, names=['date', 'time', 'doy', 'x', 'y', 'z', 'f']) for f in all_files1)
-    data1 = pd.concat(df_from_each_file, ignore_index=True)
-    df_from_each_file = (pd.read_fwf(
-        f, names=['loc', 'year', 'time', 'x', 'y', 'z', 'f']) for f in all_files2)
-    data2 = pd.concat(df_from_each_file, ignore_index=True)
-    data1 = [data1.x,
-             data1.y,
-             data1.z,
-             data1.f]
-    data2 = [data2.x,
-             data2.y,
-             data2.z,
-             data2.f]
+    # Pair up the seconds both files of a day have so gaps in either
+    # do not shift one against the other
+    data1, data2 = [], []
+    for file1, file2 in zip(all_files1, all_files2):
+        time1, day1 = read_ascii_data(file1, 'secNew')
+        time2, day2 = read_ascii_data(file2, 'sec')
+        found = align_times(time1, time2)
+        match = found >= 0
+        data1.append(day1[:, match])
+        data2.append(day2[:, found[match]])
+    data1 = list(np.hstack(data1))
+    data2 = list(np.hstack(data2))
 
     if getattr(args, 'mode') == 0:
         rotate_to_abs(data1,
@@ -16,9 +16,20 @@ Recent Changes:
 
 """
 # Default packages
+import copy
 import subprocess
 import os.path
+import shutil
+import hashlib
+import tempfile
+import traceback
+import multiprocessing
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import quote
 from datetime import timedelta, datetime
+from decimal import Decimal, ROUND_HALF_UP
 # 3rd party packages
 import numpy as np
 import pandas as pd
@@ -32,6 +43,21 @@ config = configparser.ConfigParser()
 config.read(USER+'/crio-data-reduction/option.conf')
 BASE = config['PATHS']['file_directory']
 LRT_PATH = config['PATHS']['lrt_file_directory']
+USE_CACHE = config.getboolean('CACHE', 'tdms_cache', fallback=False)
+CACHE_DIR = USER + config.get('CACHE', 'cache_dir',
+                              fallback=BASE + '/tdmsCache')
+CACHE_SIZE = config.getfloat('CACHE', 'max_size_gb', fallback=10) * 1024**3
+WORKERS = config.getint('PARALLEL', 'workers', fallback=1)
+
+logger = logging.getLogger(__name__)
+
+# Channels read from the v32Hz, v100Hz groups
+TDMS_CHANNELS = ['channel 1', 'channel 2', 'channel 3', 'channel 4',
+                 'sec of day']
+# Seconds of the days either side of a day kept to pad the filters
+EDGE_PAD = 600
+# Rows of the (4, samples) data arrays
+CHANNEL_NAMES = ('x', 'y', 'z', 'f')
 
 class UnknownFileType(Exception):
     pass
@@ -49,11 +75,152 @@ class Date():
         self.y = date.strftime('%Y')
         self.dateObj = date.date()
 
-class Data():
+# File name and sampling frequency of each Data file type
+DATA_FILES = {
+    'secNew': ('{dty}{site}{y}{m}{d}vsec.sec', 1),
+    'sec': ('{dty}{site}{y}{j}.sec', 1),
+    'min': ('{dty}{site}{y}{j}.min', 1/60),
+    'v32Hz': ('{dty}{site}{y}{m}{d}[{h}]v32Hz.tdms', 32),
+    'v32HzVoltTemp': ('{dty}{site}{y}{m}{d}[{h}]v32HzVoltTemp.tdms', 32),
+    'v100Hz': ('{dty}{site}{y}{m}{d}[{h}]v100Hz.tdms', 100),
+    }
+
+def data_path(filetype, date, site, directory, hour=None):
+    """
+    Returns the file Data reads, so it can be checked without reading it
+
+    Args:
+    ----
+        filetype: str that refers to data file formating
+        date: class that include year,month,day,doy
+        site: str 3 characters long all caps
+        directory: str file path to directory for file
+        hour: str or int hour of the tdms files
+    """
+    if filetype not in DATA_FILES:
+        raise UnknownFileType(
+            'Attribute %s does not match allowed Data file types'
+            %(filetype))
+    if isinstance(hour, int):
+        hour = fmt2(hour)
+    return DATA_FILES[filetype][0].format(dty=directory, site=site,
+                                          y=date.y, m=date.m, d=date.d,
+                                          j=date.j, h=hour)
+
+class ChannelViews():
+    """
+    Used by Data and MakeData
+
+    Names the rows of self.data, a (4, samples) array, so a channel
+    can be read as data.x instead of data.data[0]. The rows are views
+    so nothing is copied.
+    """
+    @property
+    def x(self):
+        """x channel"""
+        return self.data[0]
+
+    @property
+    def y(self):
+        """y channel"""
+        return self.data[1]
+
+    @property
+    def z(self):
+        """z channel"""
+        return self.data[2]
+
+    @property
+    def f(self):
+        """f channel"""
+        return self.data[3]
+
+    def channel(self, name):
+        """Returns the row of self.data for a name in CHANNEL_NAMES"""
+        return self.data[CHANNEL_NAMES.index(name)]
+
+GAP_DTYPE = np.dtype([('index', np.int64),
+                      ('start', np.float64),
+                      ('end', np.float64)])
+
+class TimeSeries(ChannelViews):
+    """
+    (channels, samples) data on a time axis that only goes forward but
+    can have gaps, like a day with a missing hour.
+
+    Samples are found by binary searching the time, so taking a day or
+    an hour out costs O(log n) whatever gaps come before it, and what is
+    taken out are views of the arrays, not copies. Data and MakeData are
+    TimeSeries that set time, data and samp_freq themselves.
+    """
+    # seconds in one unit of time, Data keeps time in minutes or hours
+    unit = 1
+
+    def __init__(self, time, data, samp_freq, unit=1):
+        """
+        :type time: np.array
+        :param time: time of each sample, never decreasing
+
+        :type data: np.array
+        :param data: (channels, samples) values
+
+        :type samp_freq: float
+        :param samp_freq: samples per second when there is no gap
+
+        :type unit: float
+        :param unit: seconds in one unit of time
+        """
+        self.time = time
+        self.data = data
+        self.samp_freq = samp_freq
+        self.unit = unit
+
+    def span(self, start, stop):
+        """Returns the slice of the samples from start up to stop"""
+        return slice(np.searchsorted(self.time, start, side='left'),
+                     np.searchsorted(self.time, stop, side='left'))
+
+    def between(self, start, stop):
+        """Returns a TimeSeries of the samples from start up to stop that
+        shares their memory"""
+        part = self.span(start, stop)
+        return TimeSeries(self.time[part], self.data[:, part],
+                          self.samp_freq, self.unit)
+
+    def trim(self, start, stop):
+        """Keeps only the samples from start up to stop"""
+        part = self.span(start, stop)
+        self.time = self.time[part]
+        self.data = self.data[:, part]
+
+    def gaps(self, factor=1.5):
+        """
+        Finds where samples are missing
+
+        :type factor: float
+        :param factor: steps longer than factor sample periods are gaps
+
+        :rtype: np.array of GAP_DTYPE
+        :returns: index of the sample after each gap and the times
+                  either side of it, none if there is no data yet
+        """
+        if self.samp_freq is None or len(self.time) < 2:
+            return np.empty(0, dtype=GAP_DTYPE)
+        step = np.diff(self.time)
+        after = np.nonzero(step > factor / self.samp_freq / self.unit)[0] + 1
+        gaps = np.empty(len(after), dtype=GAP_DTYPE)
+        gaps['index'] = after
+        gaps['start'] = self.time[after - 1]
+        gaps['end'] = self.time[after]
+        return gaps
+
+class Data(TimeSeries):
     """
     Holds data for x y z f and allows the user to find averages
     variance, smooth the data, get std deviation points outside
     n number of sigma.
+
+    raw and data are (4, samples) arrays, one row per channel.
     """
     def __init__(self, filetype, date, site, directory, **kwargs):
         """
@@ -66,98 +233,47 @@ class Data():
         site: str 3 characters long all caps
         directory: str file path to directory for file
         hour: used in the case of tdms files for which hour to use
+        dtype: numpy type data is kept in, np.float32 halves the
+               memory used, defaults to np.float64
         """
 
         self.date = date
         self.filetype = filetype
         self.site = site
         self.dir = directory
+        self.dtype = kwargs.get('dtype', np.float64)
         self.hour = kwargs.get('hour', None)
         if isinstance(self.hour, int):
             self.hour = fmt2(self.hour)
 
-
-        frmt = {'dty': self.dir, # for formating file dir
-                'site' : self.site,
-                'y' : date.y,
-                'm' : date.m,
-                'd' : date.d,
-                'j' : date.j,
-                'h' : self.hour
-               }
-
-        if self.filetype == 'secNew': # specify file dir
-            self.file = '{dty}{site}{y}{m}{d}vsec.sec'.format(**frmt)
-            self.samp_freq = 1
-
-        elif self.filetype == 'sec':
-            self.file = '{dty}{site}{y}{j}.sec'.format(**frmt)
-            self.samp_freq = 1
-
-        elif self.filetype == 'min':
-            self.file = '{dty}{site}{y}{j}.min'.format(**frmt)
-            self.samp_freq = 1/60
-
-        elif self.filetype == 'v32Hz':
-            self.file = '{dty}{site}{y}{m}{d}[{h}]v32Hz.tdms'.format(**frmt)
-            self.samp_freq = 32
-        elif self.filetype == 'v32HzVoltTemp':
-            self.file = '{dty}{site}{y}{m}{d}[{h}]v32HzVoltTemp.tdms'.format(**frmt)
-            self.samp_freq = 32
-
-        elif self.filetype == 'v100Hz':
-            self.file = '{dty}{site}{y}{m}{d}[{h}]v100Hz.tdms'.format(**frmt)
-            self.samp_freq = 100
-        else:
-            raise UnknownFileType(
-                'Attribute %s does not match allowed Data file types'
-                %(filetype))
-
+        self.file = data_path(filetype, date, site, directory, self.hour)
+        self.samp_freq = DATA_FILES[filetype][1]
 
 
         if not (self.filetype == 'v32Hz' or self.filetype == 'v32HzVoltTemp' or self.filetype == 'v100Hz'):
-
-            if self.filetype == 'secNew':
-                # time looks like HH:MM:SS:MSS
-                columns = ['date', 'time', 'doy', 'x', 'y', 'z', 'f']
-                data_frame = pd.read_fwf(self.file, header=None, names=columns)
-                t = datetime.strptime(data_frame['time'][0], '%H:%M:%S:%f')
-                data_frame['time'] = data_frame['time'].map(
-                    lambda x:
-                    float((datetime.strptime(x, '%H:%M:%S:%f') - t
-                         ).total_seconds()))
-
-            elif self.filetype == 'sec' or self.filetype == 'min':
-                # time looks like JJJ:HH:MM:SS
-                columns = ['loc', 'year', 'time', 'x', 'y', 'z', 'f']
-                data_frame = pd.read_fwf(self.file, header=None, names=columns)
-                t = datetime.strptime(data_frame['time'][0], '%j:%H:%M:%S')
-                data_frame['time'] = data_frame['time'].map(
-                    lambda x:
-                    float((datetime.strptime(x, '%j:%H:%M:%S') - t
-                          ).total_seconds()))
+            time, raw = read_ascii_data(self.file, self.filetype)
+            self.raw = raw.astype(self.dtype, copy=False)
             if self.hour:
-                self.time = data_frame.time/60
+                self.time = time/60
+                self.unit = 60
             else:
-                self.time = data_frame.time/3600
-            self.raw = [pd.to_numeric(data_frame.x, errors='coerce').fillna(99999.00),
-                        pd.to_numeric(data_frame.y, errors='coerce').fillna(99999.00),
-                        pd.to_numeric(data_frame.z, errors='coerce').fillna(99999.00),
-                        pd.to_numeric(data_frame.f, errors='coerce').fillna(99999.00)]
+                self.time = time/3600
+                self.unit = 3600
         else:
-            self.file = TdmsFile.read(self.file)
-            time = self.file[self.filetype]['sec of day'].data/60
+            group = read_tdms(self.file, self.filetype,
+                              TDMS_CHANNELS)[self.filetype]
+            time = group['sec of day'].data/60
             self.time = time-int(self.hour)*60
-            self.raw = [self.file[self.filetype]['channel 1'].data,
-                        self.file[self.filetype]['channel 2'].data,
-                        self.file[self.filetype]['channel 3'].data,
-                        self.file[self.filetype]['channel 4'].data]
+            self.unit = 60
+            self.raw = np.empty((4, len(time)), dtype=self.dtype)
+            for iterate in range(4):
+                self.raw[iterate] = group['channel %s'%(iterate+1)].data
 
         self.ppm = self.raw[3]
         self.data = self.raw.copy()
         # Currently undefined attributes
-        self.roc = [0, 0, 0, 0]
-        self.avg = [0, 0, 0, 0]
+        self.roc = np.zeros((4, 0), dtype=self.dtype)
+        self.avg = np.zeros(4)
         self.spikes = [0, 0, 0, 0]
         self.Fstar = None
 
@@ -174,15 +290,17 @@ class Data():
         ----------
         """
         time = time * self.samp_freq
-        for iterate in range(len(self.data)):
-            self.data[iterate] = np.convolve(self.data[iterate],
-                                             np.ones(time)/time,
-                                             mode='valid')
-
-            self.raw[iterate] = self.raw[iterate][int(time/2):-int(time/2)+1]
+        # averaged into the start of data rather than a new array
+        width = int(time)
+        self.data = moving_average(
+            self.data, width,
+            out=self.data[:, :self.data.shape[-1] - width + 1])
 
+        self.raw = self.raw[:, int(time/2):-int(time/2)+1]
         self.ppm = self.ppm[int(time/2):-int(time/2)+1]
         self.time = self.time[int(time/2):-int(time/2)+1]
+        if self.Fstar is not None:
+            self.Fstar = self.Fstar[int(time/2):-int(time/2)+1]
 
 
 
@@ -199,9 +317,7 @@ class Data():
         -------
         A new data set with averaged data
         """
-        for iterate in range(len(self.data)):
-            self.roc[iterate] = rate_of_change(self.data[iterate],
-                                               self.samp_freq)
+        self.roc = rate_of_change(self.data, self.samp_freq)
     def make_variance(self):
         """ Calculates the average of an np.array and returns
         the array with the average subtracted from each data point
@@ -215,87 +331,218 @@ class Data():
         a np.array: the new data set
         a float: the average of the data
         """
-        for iterate in range(len(self.data)):
-            self.data[iterate], self.avg[iterate] = variance(self.data[iterate])
+        self.data, self.avg = variance(self.data, out=self.data)
 
     def get_spikes(self, sigma=4.0):
         """
         creates a list of points that were n sigma away from the norm
         """
-        for iterate in range(len(self.data)):
-            self.spikes[iterate] = get_std_dev(self.raw[iterate],
-                                               self.data[iterate],
-                                               self.samp_freq,
-                                               sigma)
+        # The number of spikes differs between channels so they
+        # stay a list
+        self.spikes = [get_std_dev(raw, data, self.samp_freq, sigma)
+                       for raw, data in zip(self.raw, self.data)]
 
     def hour_range(self):
         """
         Takes day files and creates hour files out of them
         """
-        #data points = samp_freq*60*24
-        skip = int(self.hour) * 60 * 60 * self.samp_freq
-        upto = skip + self.samp_freq * 60 * 60
+        # time is in minutes, found by time so gaps before the hour
+        # do not move it
+        start = int(self.hour) * 60
+        self.trim(start, start + 60)
+        self.time = self.time - start
 
-        for iterate in range(len(self.data)):
-            self.data[iterate] = self.data[iterate][skip:upto]
+    def copy(self, hour=None):
+        """
+        Returns a Data with its own copy of the arrays, so a day read
+        once can be handed to every plot that changes it
 
-        self.time = self.time[skip:upto] - int(self.hour)*60
+        :type hour: str, int or None
+        :param hour: keep only this hour of a day of data, with time in
+                     minutes into the hour as Data(..., hour=hour) gives
+        """
+        new = copy.copy(self)
+        part = slice(None)
+        if hour is not None:
+            part = self.span(int(hour), int(hour) + 1)
+            new.hour = fmt2(int(hour))
+            new.time = (self.time[part] - int(hour)) * 60
+            new.unit = 60
+        else:
+            new.time = self.time.copy()
+        new.raw = self.raw[:, part].copy()
+        new.ppm = new.raw[3]
+        new.data = self.data[:, part].copy()
+        if self.Fstar is not None:
+            new.Fstar = self.Fstar[part].copy()
+        return new
+
+    def align_to(self, time, tolerance):
+        """
+        Keeps the sample closest to each of time and moves it onto that
+        time, times with no sample within tolerance are dropped
 
-    def chop(self, chop1, chop2):
-        """Chops of the ends of the axis to make them a certain range"""
+        :type time: np.array
+        :param time: times to align to, in the units of self.time
 
-        for iterate in range(len(self.data)):
-            self.data[iterate] = self.data[iterate][chop1:-chop2]
+        :type tolerance: float
+        :param tolerance: furthest a sample can be from its time
+        """
+        found = align_times(time, self.time, tolerance)
+        match = found >= 0
+        self.time = np.asarray(time)[match]
+        self.data = self.data[:, found[match]]
+        self.raw = self.raw[:, found[match]]
+        self.ppm = self.raw[3]
+        if self.Fstar is not None:
+            self.Fstar = self.Fstar[found[match]]
 
-        self.time = self.time[chop1:-chop2]
+    def chop(self, chop1, chop2):
+        """Chops of the ends of the axis to make them a certain range"""
+        keep = slice(chop1, len(self.time) - chop2)
+        self.data = self.data[:, keep]
+        self.time = self.time[keep]
 
-        if self.Fstar:
-            self.Fstar = self.Fstar[chop1:-chop2]
+        if self.Fstar is not None:
+            self.Fstar = self.Fstar[keep]
 
     def fstar(self):
         """Creates the estimated F and saves the old one under raw"""        
         
-        self.data[3] = np.sqrt(self.data[0]**2 +
-                               self.data[1]**2 +
-                               self.data[2]**2)
+        np.sqrt(np.einsum('ij,ij->j', self.data[:3], self.data[:3]),
+                out=self.data[3])
         
-        self.fstar = self.data[3]
+        # Copied since make_variance() centres data in place
+        self.Fstar = self.data[3].copy()
         
 
         
 
     def ffstar(self):
         """Returns a numpy array of f-f*"""
-        return self.fstar - self.ppm
-
-class MakeData():
-    """ Used by rt1hz.py """
-    def __init__(self):
-        self.data = [np.array([]),
-                     np.array([]),
-                     np.array([]),
-                     np.array([])]
+        return self.Fstar - self.ppm
+
+class DayBuffer():
+    """
+    Used by MakeData
+
+    Preallocates room for a number of hours of every channel so each
+    hour added is copied once into its slot instead of the whole day
+    being copied again by np.hstack.
+    """
+    def __init__(self, samp_freq, hours, channels=4, dtype=np.float64):
+        """
+        :type samp_freq: int
+        :param samp_freq: samples per second of the data to be added
+
+        :type hours: int
+        :param hours: number of hours expected, used for the capacity
+
+        :type channels: int
+        :param channels: number of data channels along with the time
+
+        :type dtype: numpy type
+        :param dtype: type the channels are kept in, time is float64
+        """
+        self.data = np.empty((channels, int(samp_freq*60*60*hours)),
+                             dtype=dtype)
+        self.time = np.empty(self.data.shape[1])
+        self.size = 0
+
+    def add(self, channels, time):
+        """
+        Copies an hour of data into the next free slot
+
+        :type channels: (channels, samples) np.array or list of np.array
+        :param channels: one row per channel
+
+        :type time: np.array
+        :param time: time of each sample
+        """
+        end = self.size + len(time)
+        if end > self.data.shape[1]:
+            # Hours can be longer than expected, double so it stays linear
+            self.grow(max(end, 2*self.data.shape[1]))
+
+        for iterate in range(len(self.data)):
+            self.data[iterate, self.size:end] = channels[iterate]
+        self.time[self.size:end] = time
+        self.size = end
+
+    def grow(self, capacity):
+        """Moves the filled part of the buffer into a larger one"""
+        data = np.empty((len(self.data), capacity), dtype=self.data.dtype)
+        data[:, :self.size] = self.data[:, :self.size]
+        time = np.empty(capacity)
+        time[:self.size] = self.time[:self.size]
+        self.data, self.time = data, time
+
+    def channels(self):
+        """Returns a (channels, samples) view of the filled part"""
+        return self.data[:, :self.size]
+
+    def times(self):
+        """Returns a view of the filled part of the time"""
+        return self.time[:self.size]
+
+class MakeData(TimeSeries):
+    """ Used by rt1hz.py, data is a (4, samples) array and time is
+    seconds from the start of the day being made """
+    def __init__(self, hours=26, dtype=np.float64):
+        """
+        :type hours: int
+        :param hours: number of hours that will be added, used to size
+                      the day buffer
+
+        :type dtype: numpy type
+        :param dtype: type the channels are kept in, np.float32 halves
+                      the memory used
+        """
+        self.data = np.empty((4, 0), dtype=dtype)
         self.time = np.array([])
+        self.samp_freq = None
+        self.hours = hours
+        self.dtype = dtype
+        self.buffer = None
 
     def chop(self, chop1, chop2):
-        """Chops edges of paramaters"""
-        for iterate in range(len(self.data)):
-            self.data[iterate] = self.data[iterate][chop1:-chop2]
-        self.time = self.time[chop1:-chop2]
+        """Chops edges of paramaters, see trim to chop by time"""
+        keep = slice(chop1, len(self.time) - chop2)
+        self.data = self.data[:, keep]
+        self.time = self.time[keep]
+        self.buffer = None
+
+    def add_tdms(self, loc, date, hour, ppm=False, voltTemp=False,
+                 time_window=None, offset=0):
+        """
+        Reads a tdms file and adds its data
 
-    def add_tdms(self, loc, date, hour, ppm=False, voltTemp=False):
+        :type time_window: (float, float) or None
+        :param time_window: only add samples with a 'sec of day' from
+                            start up to stop, used to pad the day
+
+        :type offset: float
+        :param offset: seconds added to 'sec of day' so time keeps going
+                       forward, -86400 for the day before the one being
+                       made and 86400 for the day after
+        """
         date.d = fmt2(date.d)
         date.m = fmt2(date.m)
-        datafile = GetTdms(loc, date, hour, ppm, voltTemp)
+        if ppm:
+            channels = ['channel 1', 'sec of day']
+        else:
+            channels = TDMS_CHANNELS
+        datafile = GetTdms(loc, date, hour, ppm, voltTemp,
+                           channels=channels, time_window=time_window)
         
         if ppm:
             self.add_f(datafile)
         elif voltTemp:
-            self.add_voltTemp(datafile)
+            self.add_voltTemp(datafile, offset)
         else:
-            self.add_xyz(datafile)
+            self.add_xyz(datafile, offset)
 
-    def filtsample(self, filt_freq, desr_freq, samp_freq):
+    def filtsample(self, filt_freq, desr_freq, samp_freq, method='butter'):
         """
         Both filters then samples the inputed data
 
@@ -307,53 +554,85 @@ class MakeData():
 
         :type samp_freq: float
         :param samp_freq: current sampling frequency
+
+        :type method: str
+        :param method: 'butter' filters every sample with butter_low_pass
+                       then keeps every cnt-th one, 'chunked' does the
+                       same a block at a time with chunked_low_pass,
+                       'polyphase' decimates in FIR stages and only
+                       filters the samples kept
         """
         dif = -abs(samp_freq*60*60*26 - len(self.data[0]))
         cnt = round(len(self.time)/desr_freq)
 
-        for iterate in range(len(self.data)):
-            self.data[iterate] = butter_low_pass(self.data[iterate],
-                                                 filt_freq,
-                                                 samp_freq)
-            self.data[iterate] = self.data[iterate][::cnt]
-            self.data[iterate] = self.data[iterate][:desr_freq]
+        if method == 'polyphase':
+            data = polyphase_decimate(self.data, cnt, filt_freq, samp_freq)
+        elif method == 'chunked':
+            data = chunked_low_pass(self.data, filt_freq, samp_freq,
+                                    step=cnt)
+        elif method == 'butter':
+            data = butter_low_pass(self.data, filt_freq, samp_freq)[:, ::cnt]
+        else:
+            raise ValueError('Unknown filtsample method %s'%(method))
+        self.data = data[:, :desr_freq].astype(self.dtype)
         
         self.time = self.time[::cnt] 
         self.time = self.time[:desr_freq]
-        
-    def add_xyz(self, data):
+        self.samp_freq = samp_freq / cnt
+        self.buffer = None
+
+    def add_hour(self, group, samp_freq, offset=0):
+        """
+        Copies the channels of a tdms group into the day buffer
+
+        :type group: TdmsGroup
+        :param group: group holding 'channel 1'-'channel 4' and 'sec of day'
+
+        :type samp_freq: int
+        :param samp_freq: sampling frequency of the group
+
+        :type offset: float
+        :param offset: seconds added to 'sec of day'
+        """
+        if self.buffer is None:
+            # Start a buffer with whatever data was already collected
+            self.buffer = DayBuffer(samp_freq, self.hours, len(self.data),
+                                    self.dtype)
+            if len(self.time):
+                self.buffer.add(self.data, self.time)
+
+        self.buffer.add([group['channel %s'%(iterate+1)].data
+                         for iterate in range(len(self.data))],
+                        group['sec of day'].data + offset)
+        self.data = self.buffer.channels()
+        self.time = self.buffer.times()
+        self.samp_freq = samp_freq
+
+    def add_xyz(self, data, offset=0):
         """
         Adds the mag data to the current data
 
         :type data: TdmsFile
         :param data: mag data file
+
+        :type offset: float
+        :param offset: seconds added to 'sec of day'
         """
-        tdms = data.file
-        for iterate in range(len(self.data)):
-            group = 'v100Hz'
-            channel = 'channel %s'%(iterate+1)
-            self.data[iterate] = np.hstack((self.data[iterate],
-                                            tdms[group][channel].data))
-        self.time = np.hstack((self.time, 
-                               tdms[group]['sec of day'].data))
+        self.add_hour(data.file['v100Hz'], 100, offset)
 
-    def add_voltTemp(self, data):
+    def add_voltTemp(self, data, offset=0):
         """
         Adds the volt temp data to the current data
 
         :type data: TdmsFile
         :param data: mag data file
+
+        :type offset: float
+        :param offset: seconds added to 'sec of day'
         """
-        tdms = data.file
-        for iterate in range(len(self.data)):
-            """ The group name for voltTemp data is
-            the same as xyz as determined by cRio daq """
-            group = 'v32Hz'
-            channel = 'channel %s'%(iterate+1)
-            self.data[iterate] = np.hstack((self.data[iterate],
-                                            tdms[group][channel].data))
-        self.time = np.hstack((self.time, 
-                               tdms[group]['sec of day'].data))
+        # The group name for voltTemp data is the same
+        # as xyz as determined by cRio daq
+        self.add_hour(data.file['v32Hz'], 32, offset)
     def add_f(self, data):
         """
         Adds the ppm data
@@ -363,15 +642,12 @@ class MakeData():
         """
         time = data.file['v1sec']['sec of day'].data
         data = data.file['v1sec']['channel 1'].data
- 
-        #print('ppm: ' + str(len(data)))
-        #print('xyz: ' + str(len(self.data[3])))        
-        #self.data[3] = np.hstack((self.data[3],data[:86400]))
-        
-        xyz_time = np.rint(self.time)
-        ppm_time = np.rint(time[:86400])
-        xyz_good = np.where(xyz_time == ppm_time)[0]
-        self.data[3][xyz_good] = data[xyz_good]
+
+        # Only samples of ppm within half a second of an xyz sample
+        # replace it, either can have gaps
+        found = align_times(self.time, time)
+        xyz_good = np.nonzero(found >= 0)[0]
+        self.data[3][xyz_good] = data[found[xyz_good]]
 
     def quick_fourier_plot(self, samp_freq): # used for visual debugging
         """:
@@ -392,34 +668,32 @@ class GetTdms():
     and allows the user to call on a group channel pairing
     to recieve its data.
     """
-    def __init__(self, loc, date, hour, ppm=False, voltTemp=False):
+    def __init__(self, loc, date, hour, ppm=False, voltTemp=False,
+                 channels=None, window=None, time_window=None):
+        """
+        :type channels: list of str or None
+        :param channels: channels of the group to read, all if None
 
-        if ppm:
-            my_file = (LRT_PATH + '/{0}/Serial/' +
-                       '{1}/{0}{1}{2}{3}v1sec.tdms').format(loc, date.y,
-                                                            date.m, date.d)
+        :type window: (int, int) or None
+        :param window: only read samples start to stop
 
+        :type time_window: (float, float) or None
+        :param time_window: only read samples with a 'sec of day'
+                            from start up to stop
+        """
+        if ppm:
+            group = 'v1sec'
         elif voltTemp:
-            my_file = (LRT_PATH + '/{0}/Serial/' +
-                       '{1}/{2}/{0}{1}{2}{3}[{4}]v32HzVoltTemp.tdms').format(loc, date.y,
-                                                                         date.m,
-                                                                         date.d,
-                                                                         hour)
+            group = 'v32Hz'
+        else:
+            group = 'v100Hz'
+
+        my_file = tdms_path(loc, date, hour, ppm, voltTemp)
+        if channels is None and window is None and time_window is None:
+            self.file = read_tdms(my_file)
         else:
-            my_file = (LRT_PATH + '/{0}/Analog/' +
-                       '{1}/{0}{1}{2}{3}[{4}]v100Hz.tdms').format(loc, date.y,
-                                                                 date.m,
-                                                                 date.d,
-                                                                 hour)
-
-            """
-            my_file = (LRT_PATH + '/{0}/Serial/' +
-                       '{1}/{0}{1}{2}{3}[{4}]v32Hz.tdms').format(loc, date.y,
-                                                                 date.m,
-                                                                 date.d,
-                                                                 hour)
-            """
-        self.file = TdmsFile.read(my_file)
+            self.file = read_tdms(my_file, group, channels,
+                                  window, time_window)
 
     def get_data(self, samp_freq, channel, ppm=False):
         """Returns the data for a channel group selected"""
@@ -430,25 +704,464 @@ class GetTdms():
         channel = ('channel ' + str(channel))
         return self.file[group][channel].data
 
+def tdms_path(loc, date, hour, ppm=False, voltTemp=False):
+    """ Returns the tdms file GetTdms reads for a location, date and
+    hour, the v1sec ppm files hold a whole day so hour is ignored """
+    if ppm:
+        return (LRT_PATH + '/{0}/Serial/' +
+                '{1}/{0}{1}{2}{3}v1sec.tdms').format(loc, date.y,
+                                                     date.m, date.d)
+
+    if voltTemp:
+        return (LRT_PATH + '/{0}/Serial/' +
+                '{1}/{2}/{0}{1}{2}{3}[{4}]v32HzVoltTemp.tdms').format(loc, date.y,
+                                                                  date.m,
+                                                                  date.d,
+                                                                  hour)
+    # The 32hz mag files were read from
+    # LRT_PATH/{0}/Serial/{1}/{0}{1}{2}{3}[{4}]v32Hz.tdms
+    return (LRT_PATH + '/{0}/Analog/' +
+            '{1}/{0}{1}{2}{3}[{4}]v100Hz.tdms').format(loc, date.y,
+                                                      date.m,
+                                                      date.d,
+                                                      hour)
+
+
+# Columns of the text files and the layout of their time field. The
+# time field is fixed width, the number is the character offset of the
+# days, hours, minutes, seconds and milliseconds in it (None if absent)
+ASCII_COLUMNS = {
+    # time looks like HH:MM:SS:MSS
+    'secNew': (['date', 'time', 'doy', 'x', 'y', 'z', 'f'],
+               'HH:MM:SS:MSS', (None, 0, 3, 6, 9)),
+    # time looks like JJJ:HH:MM:SS
+    'sec': (['loc', 'year', 'time', 'x', 'y', 'z', 'f'],
+            'JJJ:HH:MM:SS', (0, 4, 7, 10, None)),
+    'min': (['loc', 'year', 'time', 'x', 'y', 'z', 'f'],
+            'JJJ:HH:MM:SS', (0, 4, 7, 10, None)),
+    }
+
+def read_ascii_data(filename, filetype):
+    """
+    Reads an OTT .sec/.min or LRT vsec.sec file without converting
+    each time with datetime.strptime. Raises ValueError if a row does
+    not have the fields of filetype or its time does not match them
 
-def rate_of_change(data, samp_freq):
-    """Helper function for make_rate_of_change()"""
-    roc = np.zeros(len(data))
-    for check_time in range(1, len(data) - 1):
-        roc[check_time] = ((data[check_time] -
-                            data[check_time-1]) *
-                           samp_freq)
+    Args:
+    ----
+        filename (str): file to read
+        filetype (str): 'sec', 'min' or 'secNew'
+
+    Returns:
+    -------
+        np.array: seconds of each row since midnight of the day of the
+        first row, so files that start late still line up by time
+        np.array: (4, rows) of x, y, z, f with values that are not
+        numbers replaced by 99999.00
+    """
+    if filetype not in ASCII_COLUMNS:
+        raise UnknownFileType(
+            'Attribute %s does not match allowed text file types'
+            %(filetype))
+    columns, layout, offsets = ASCII_COLUMNS[filetype]
+
+    # A blank or merged field would move every value after it into the
+    # wrong channel, so every row must have exactly the fields of the
+    # layout. With na_filter off a field a row does not have is read as
+    # '', so a row with too few leaves its last field empty and one with
+    # too many fills the spare field
+    data_frame = pd.read_csv(filename, sep=r'\s+', header=None,
+                             names=columns + ['spare'], dtype={'time': str},
+                             na_filter=False)
+    wrong = np.nonzero((data_frame[columns[-1]] == '').to_numpy() |
+                       (data_frame['spare'] != '').to_numpy())[0]
+    if len(wrong):
+        raise ValueError('Line %s of %s does not have the %s fields of %s'
+                         %(wrong[0] + 1, filename, len(columns), filetype))
+
+    # Turn the time field into a (rows, width) array of digits
+    field = data_frame['time'].to_numpy(dtype=str).astype(
+        'S%s'%(len(layout)))
+    chars = field.view(np.uint8).reshape(len(field), len(layout))
+    colons = [pos for pos, char in enumerate(layout) if char == ':']
+    digits = chars.astype(np.int64) - ord('0')
+    if (np.any(chars[:, colons] != ord(':')) or
+            np.any(np.delete(digits, colons, axis=1) > 9) or
+            np.any(np.delete(digits, colons, axis=1) < 0)):
+        raise ValueError('Time in %s does not look like %s'
+                         %(filename, layout))
+
+    def number(start, width):
+        """Integer made of the digits at start"""
+        if start is None:
+            return 0
+        return digits[:, start:start+width] @ (10**np.arange(width)[::-1])
+
+    day, hour, minute, second, mili = offsets
+    days = number(day, 3)
+    if day is not None: # count from the day of the first row
+        days = days - days[:1]
+    mili = ((((days*24 + number(hour, 2))*60 +
+              number(minute, 2))*60 + number(second, 2))*1000 +
+            number(mili, 3))
+    time = mili/1000
+
+    channels = np.empty((4, len(time)))
+    for iterate, axis in enumerate(CHANNEL_NAMES):
+        channels[iterate] = pd.to_numeric(data_frame[axis], errors='coerce'
+                                          ).fillna(99999.00)
+    return time, channels
+
+class CachedChannel():
+    """Stands in for a tdms channel so cached data is used the same way"""
+    def __init__(self, data):
+        self.data = data
+
+
+class TdmsCache():
+    """
+    Used by GetTdms, Data
+
+    Keeps the decoded channels of every tdms file read as .npy blocks
+    on disk so the next stage to want the same file memory maps them
+    instead of decoding the file again. Entries are keyed by the
+    source path, size and mtime so a file that changes is decoded
+    again. Only the channels asked for are decoded, the rest are added
+    the first time they are wanted. Least recently used entries are
+    removed once the cache grows past max_size bytes.
+    """
+    def __init__(self, directory, max_size):
+        self.dir = directory
+        self.max_size = max_size
+
+    def key(self, path):
+        """Returns the entry name for a tdms file"""
+        stat = os.stat(path)
+        ident = '%s|%s|%s'%(os.path.abspath(path), stat.st_size,
+                            stat.st_mtime_ns)
+        return hashlib.sha1(ident.encode()).hexdigest()
+
+    def read(self, path, group=None, channels=None):
+        """
+        Returns channels of a tdms file as {group: {channel: CachedChannel}}
+
+        :type path: str
+        :param path: tdms file to read
+
+        :type group: str or None
+        :param group: only read this group, all groups if None
+
+        :type channels: list of str or None
+        :param channels: only read these channels of the group, all
+                         channels if None
+        """
+        entry = os.path.join(self.dir, self.key(path))
+        wanted = self.wanted(path, entry, group, channels)
+        missing = [pair for pair in wanted
+                   if not os.path.isfile(self.block(entry, *pair))]
+        if missing:
+            with TdmsFile.open(path) as tdms:
+                # Room is made before storing so the cache never holds
+                # more than max_size, channels that do not fit even on
+                # their own are handed back without being kept
+                adding = sum(self.stored_size(tdms[group][channel])
+                             for group, channel in missing)
+                if self.evict(keep=entry, adding=adding) > self.max_size:
+                    return {group: {channel: CachedChannel(
+                        np.asarray(tdms[group][channel][:]))
+                                    for channel in channels}
+                            for group, channels in self.by_group(wanted)}
+                self.store(tdms, entry, missing)
+        else:
+            os.utime(entry) # mark as recently used
+        return self.load(entry, wanted)
+
+    def block(self, entry, group, channel):
+        """Returns the .npy file of a channel"""
+        return os.path.join(entry, quote(group, safe=' '),
+                            quote(channel, safe=' ') + '.npy')
+
+    def wanted(self, path, entry, group, channels):
+        """Lists the (group, channel) pairs of a read"""
+        if group is not None and channels is not None:
+            return [(group, channel) for channel in channels]
+
+        # The list of channels is only in the file metadata, keep a copy
+        index = os.path.join(entry, 'channels.txt')
+        if not os.path.isfile(index):
+            with TdmsFile.open(path) as tdms:
+                pairs = ['%s\t%s\n'%(grp.name, channel.name)
+                         for grp in tdms.groups()
+                         for channel in grp.channels()]
+            os.makedirs(entry, exist_ok=True)
+            self.save(index, lambda temp: temp.write(''.join(pairs).encode()))
+
+        with open(index) as names:
+            pairs = [tuple(line.rstrip('\n').split('\t'))
+                     for line in names]
+        return [pair for pair in pairs if group in (None, pair[0])]
+
+    def save(self, name, write):
+        """Writes a file under a temporary name then moves it in place"""
+        handle, temp = tempfile.mkstemp(prefix='tmp', dir=os.path.dirname(name))
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                write(temp_file)
+            os.replace(temp, name)
+        except:
+            os.remove(temp)
+            raise
+
+    def stored_size(self, channel):
+        """Returns the bytes the .npy block of a tdms channel will take"""
+        return 128 + len(channel) * np.dtype(channel.dtype).itemsize
+
+    def by_group(self, pairs):
+        """Returns (group, [channel, ...]) of the (group, channel) pairs"""
+        groups = {}
+        for group, channel in pairs:
+            groups.setdefault(group, []).append(channel)
+        return groups.items()
+
+    def store(self, tdms, entry, pairs):
+        """Decodes the channels listed from the open tdms file and saves
+        them in the entry"""
+        for group, channel in pairs:
+            data = np.asarray(tdms[group][channel][:])
+            name = self.block(entry, group, channel)
+            os.makedirs(os.path.dirname(name), exist_ok=True)
+            self.save(name, lambda temp: np.save(temp, data,
+                                                 allow_pickle=False))
+
+    def load(self, entry, pairs):
+        """Memory maps the channels listed"""
+        return {group: {channel: CachedChannel(
+            np.load(self.block(entry, group, channel), mmap_mode='c'))
+                        for channel in channels}
+                for group, channels in self.by_group(pairs)}
+
+    def evict(self, keep=None, adding=0):
+        """
+        Removes the oldest entries until the cache, with adding bytes
+        more, fits in max_size. keep, the entry being read, counts
+        towards the size but is never removed
+
+        :rtype: int
+        :returns: bytes the cache holds once adding is stored
+        """
+        entries = []
+        total = adding
+        for name in os.listdir(self.dir):
+            entry = os.path.join(self.dir, name)
+            if not os.path.isdir(entry):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, f))
+                       for root, _, files in os.walk(entry) for f in files)
+            total += size
+            if entry != keep:
+                entries.append((os.path.getmtime(entry), size, entry))
+
+        if total - sum(size for _, size, _ in entries) > self.max_size:
+            return total # would not fit on its own, keep the rest
+        for _, size, entry in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+        return total
+
+
+TDMS_CACHE = TdmsCache(CACHE_DIR, CACHE_SIZE)
+
+def read_tdms(path, group=None, channels=None, window=None,
+              time_window=None):
+    """
+    Reads a tdms file through the decoded file cache when it is enabled.
+    The returned object is indexed like a TdmsFile, file[group][channel].data
+
+    Args:
+    ----
+        path (str): tdms file to read
+        group (str): only read this group
+        channels (list of str): only read these channels of group
+        window ((int, int)): only keep samples start to stop of group
+        time_window ((float, float)): only keep samples of group with a
+            'sec of day' from start up to stop
+
+    Note:
+    ----
+        Without a group every channel is decoded like TdmsFile.read.
+    With one only the channels asked for are decoded and when the cache
+    is off they are streamed with TdmsFile.open, so the rest of the file
+    is never loaded.
+    """
+    if group is None:
+        return read_tdms_group(path)
+
+    if time_window is not None:
+        time = read_tdms_group(path, group, ['sec of day'])
+        time = time[group]['sec of day'].data
+        window = (int(np.searchsorted(time, time_window[0])),
+                  int(np.searchsorted(time, time_window[1])))
+    return read_tdms_group(path, group, channels, window)
+
+def read_tdms_group(path, group=None, channels=None, window=None):
+    """Helper for read_tdms(), decodes through the cache or directly"""
+    start, stop = window if window is not None else (None, None)
+    if USE_CACHE:
+        if not os.path.isfile(path):
+            raise FileNotFoundError('No such file: %s'%(path))
+        try:
+            tdms = TDMS_CACHE.read(path, group, channels)
+        except (OSError, ValueError) as err:
+            # Cache unusable (full disk, permissions, stale entry) so
+            # decode the file directly, a corrupt file will raise again
+            logger.warning('TDMS cache skipped for %s: %s', path, err)
+        else:
+            # Blocks are memory mapped so slicing reads nothing else
+            if group is not None:
+                for channel in tdms[group].values():
+                    channel.data = channel.data[start:stop]
+            return tdms
+
+    if group is None:
+        return TdmsFile.read(path)
 
+    with TdmsFile.open(path) as tdms:
+        if channels is None:
+            channels = [channel.name for channel in tdms[group].channels()]
+        return {group: {channel: CachedChannel(
+            np.asarray(tdms[group][channel][start:stop]))
+                        for channel in channels}}
+
+
+def align_times(target, source, tolerance=.5):
+    """ Finds the sample of source closest in time to every time in
+    target, an as-of merge that allows for gaps, duplicates and
+    unsorted times in either. Sorts source once and binary searches it
+    so it takes O(n log n)
+
+    Args:
+    ----
+        target (np.array): times to find samples for
+        source (np.array): times of the samples that can be used
+        tolerance (float): furthest a sample can be from its target
+            time, in the units of the times
+
+    Returns:
+    -------
+        np.array: index into source for each target time, -1 where
+        no sample is within tolerance. Ties go to the earlier time and
+        duplicates to the first of them
+    """
+    target = np.asarray(target, dtype=np.float64)
+    source = np.asarray(source, dtype=np.float64)
+    found = np.full(len(target), -1, dtype=np.int64)
+    if not len(source):
+        return found
+
+    order = np.argsort(source, kind='stable')
+    ordered = source[order]
+    after = np.searchsorted(ordered, target, side='left')
+    before = np.maximum(after - 1, 0)
+    after = np.minimum(after, len(ordered) - 1)
+
+    to_before = np.abs(target - ordered[before])
+    to_after = np.abs(ordered[after] - target)
+    nearest = np.where(to_before <= to_after, before, after)
+    close = np.minimum(to_before, to_after) <= tolerance
+    found[close] = order[nearest[close]]
+    return found
+
+def rate_of_change(data, samp_freq):
+    """Helper function for make_rate_of_change(), works along the last
+    axis so every channel of a (4, samples) array is done at once. The
+    first and last samples are left at 0"""
+    roc = np.zeros_like(data)
+    np.subtract(data[..., 1:-1], data[..., :-2], out=roc[..., 1:-1])
+    roc *= samp_freq
     return roc
 
-def variance(array):
-    """ Helper for makeVariance"""
-    avg = np.mean(array)
-    array = array - avg
-    return array, float('{0:.2f}'.format(avg))
+def moving_average(data, width, out=None):
+    """ Helper for make_smooth(), the running mean of width samples
+    along the last axis, aligned like np.convolve(mode='valid').
 
+    Uses differences of a running sum so the time taken does not depend
+    on width. The mean of each channel is taken out first so the sums
+    stay small and rounding does not build up along the day. Channels
+    are summed one at a time so only one channel is ever held in
+    float64 and the averages keep the dtype of data. A nan only makes
+    the averages of the windows it is in nan, as np.convolve does
+
+    Args:
+    ----
+        data (np.array): one channel or a (channels, samples) array
+        width (int): samples averaged
+        out (np.array): where to put the averages, can be the start of
+                        each channel of data itself
 
-def get_std_dev(raw_data, smooth_data, samp_freq, sigma=4.0):
+    Returns:
+    -------
+        np.array: samples - width + 1 averages per channel
+    """
+    width = int(width)
+    data = np.asarray(data)
+    if not 0 < width <= data.shape[-1]:
+        raise ValueError('Cannot average %s samples of %s'
+                         %(width, data.shape[-1]))
+    dtype = data.dtype if data.dtype.kind == 'f' else np.float64
+    rows = data.reshape(-1, data.shape[-1])
+    shape = data.shape[:-1] + (data.shape[-1] - width + 1,)
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    # a channel is summed before its averages are written, so out can
+    # overlap the channel it is the average of
+    smooth = out.reshape(len(rows), shape[-1])
+    total = np.zeros(rows.shape[-1] + 1)
+    count = None
+    for row, average in zip(rows, smooth):
+        finite = np.isfinite(row)
+        avg = row[finite].mean(dtype=np.float64) if finite.any() else 0.
+        np.subtract(row, avg, out=total[1:])
+        total[1:][~finite] = 0
+        np.cumsum(total, out=total)
+        np.subtract(total[width:], total[:-width], out=average)
+        average /= width
+        average += avg
+        if not finite.all():
+            # windows with a nan in them have fewer finite samples
+            if count is None:
+                count = np.zeros(rows.shape[-1] + 1, dtype=np.int64)
+            np.cumsum(finite, out=count[1:])
+            average[count[width:] - count[:-width] < width] = np.nan
+    return out
+
+def variance(array, out=None):
+    """ Helper for makeVariance, removes the mean along the last axis
+
+    Args:
+    ----
+        array (np.array): one channel or a (channels, samples) array
+        out (np.array): where to put the result, can be array itself
+
+    Returns:
+    -------
+        np.array: array with its mean removed
+        float or np.array: the mean of each channel to 2 decimals
+    """
+    avg = np.mean(array, axis=-1, dtype=np.float64)
+    array = np.subtract(array, avg[..., None], out=out, casting='unsafe')
+    rounded = np.array([float('{0:.2f}'.format(value))
+                        for value in np.ravel(avg)]).reshape(np.shape(avg))
+    return array, rounded[()]
+
+
+SPIKE_DTYPE = np.dtype([('index', np.int64),
+                        ('time', np.float64),
+                        ('value', np.float64)])
+
+def get_std_dev(raw_data, smooth_data, samp_freq, sigma=4.0,
+                structured=False):
     """ Takes the raw set of data and the time average set
     and records the data points which where sigma times the
     standard deviation away
@@ -458,58 +1171,549 @@ def get_std_dev(raw_data, smooth_data, samp_freq, sigma=4.0):
         smooth_data(np.array): time averaged data
         samp_freq(int): the number of samples per second of raw_data
         sigma (float): how many std dev away to look for
+        structured (bool): return a SPIKE_DTYPE array instead
 
     Retruns:
     -------
         np.array([(float,float)],[(float,float)]): array of t,y values
-        of large deviation data points
+        of large deviation data points, the first pair is always nan
+
+        or if structured a np.array of (index, time, value) records
+        with time in minutes, one per data point
     """
+    raw_data = np.asarray(raw_data)
+    smooth_data = np.asarray(smooth_data)
 
     seperation = raw_data - smooth_data
     std = np.std(seperation)
 
-    # makes an array of all (x,y) points that are outside
-    # of the std deviation
-    return np.array([
-        [np.nan, np.nan],
-        *[(num / samp_freq / 60, raw_data[num])
-          for num in range(len(smooth_data))
-            if ((raw_data[num] > (smooth_data[num] + (sigma*std))) or
-              (raw_data[num] < (smooth_data[num] - (sigma*std))))
-         ]]).transpose()
+    # finds all points that are outside of the std deviation
+    raw_data = raw_data[:len(smooth_data)]
+    spikes = np.nonzero((raw_data > (smooth_data + (sigma*std))) |
+                        (raw_data < (smooth_data - (sigma*std))))[0]
+    times = spikes / samp_freq / 60
+
+    if structured:
+        points = np.empty(len(spikes), dtype=SPIKE_DTYPE)
+        points['index'] = spikes
+        points['time'] = times
+        points['value'] = raw_data[spikes]
+        return points
+
+    return np.array([np.hstack(([np.nan], times)),
+                     np.hstack(([np.nan], raw_data[spikes]))])
+
+EVENT_DTYPE = np.dtype([('start', np.float64),
+                        ('end', np.float64),
+                        ('count', np.int64),
+                        ('peak', np.float64)])
+
+def cluster_events(data, values=None, gap=1.5):
+    """
+    Groups sorted spike times into events. A new event starts whenever
+    the next time is more than gap after the previous one
 
+    :type data: numpy array
+    :param data: sorted times of the spikes, nan values are ignored
 
+    :type values: numpy array or None
+    :param values: value of each spike, used for the peak of each event
 
+    :type gap: float
+    :param gap: largest step between two times of the same event
+
+    :rtype: numpy array of EVENT_DTYPE
+    :returns: start, end, count and peak (largest absolute value, nan
+              when no values are given) of every event
+    """
+    data = np.asarray(data, dtype=np.float64)
+    keep = ~np.isnan(data)
+    data = data[keep]
+    if not len(data):
+        return np.empty(0, dtype=EVENT_DTYPE)
+
+    # Same test as data[i] <= data[i-1] + gap so rounding matches the
+    # old loop exactly
+    starts = np.hstack(([0], np.nonzero(data[1:] > data[:-1] + gap)[0] + 1))
+    ends = np.hstack((starts[1:], [len(data)])) - 1
+
+    events = np.empty(len(starts), dtype=EVENT_DTYPE)
+    events['start'] = data[starts]
+    events['end'] = data[ends]
+    events['count'] = np.add.reduceat(np.ones(len(data), dtype=np.int64),
+                                      starts)
+    if values is None:
+        events['peak'] = np.nan
+    else:
+        values = np.abs(np.asarray(values, dtype=np.float64)[keep])
+        events['peak'] = np.maximum.reduceat(values, starts)
+    return events
+
+class SpikeDetector():
+    """
+    Streaming version of get_std_dev() for one channel.
+
+    Samples are pushed in blocks as they are read. Each sample is
+    compared to a running average of smooth seconds centred on it and
+    flagged when it is sigma times the spread of the last window seconds
+    away, so a noisy stretch only raises the threshold near itself.
+    Flagged samples less than gap apart are grouped into EVENT_DTYPE
+    spans, which are returned once nothing within gap can extend them.
+
+    Only the last window seconds are kept, blocks can be any size and
+    spans carry across the edges of blocks (and hour files).
+    """
+    def __init__(self, samp_freq, window=600, sigma=4.0, method='rolling',
+                 smooth=10, gap=90, warmup=60):
+        """
+        :type samp_freq: int
+        :param samp_freq: samples per second
+
+        :type window: float
+        :param window: seconds the spread is measured over
+
+        :type sigma: float
+        :param sigma: spreads away from the centre that get flagged
+
+        :type method: str
+        :param method: 'rolling' uses the mean and standard deviation of
+                       the window, 'mad' its median and median absolute
+                       deviation, which a burst of spikes can not inflate
+
+        :type smooth: float
+        :param smooth: seconds of the running average, like make_smooth
+
+        :type gap: float
+        :param gap: largest step in time between two samples of a span,
+                    in the units of the times pushed
+
+        :type warmup: float
+        :param warmup: seconds of data needed before anything is flagged
+        """
+        if method not in ('rolling', 'mad'):
+            raise ValueError('Unknown spike detector method %s'%(method))
+        self.samp_freq = samp_freq
+        self.window = int(window * samp_freq)
+        self.sigma = sigma
+        self.method = method
+        self.width = int(smooth * samp_freq)
+        self.gap = gap
+        self.warmup = int(min(window, warmup) * samp_freq)
+        self.raw = np.empty(0)        # samples the average still needs
+        self.time = np.empty(0)       # times of those samples
+        self.seperation = np.empty(0) # last window of raw - smooth
+        self.deviation = np.empty(0)  # last window of |seperation - median|
+        self.seen = 0                 # samples compared so far
+        self.event = None             # span that can still grow
+
+    def push(self, time, raw):
+        """
+        Checks the next block of samples
+
+        :type time: np.array
+        :param time: time of each sample, exp: sec of day
+
+        :type raw: np.array
+        :param raw: the samples
+
+        :rtype: np.array of EVENT_DTYPE
+        :returns: spans that are complete, peak is the largest distance
+                  from the centre
+        """
+        raw = np.hstack((self.raw, raw))
+        time = np.hstack((self.time, time))
+        keep = len(raw) - self.width + 1
+        self.raw, self.time = raw[max(keep, 0):], time[max(keep, 0):]
+        if keep <= 0:
+            return np.empty(0, dtype=EVENT_DTYPE)
+
+        half = self.width // 2
+        centre = raw[half:half+keep]
+        time = time[half:half+keep]
+        seperation = centre - moving_average(raw, self.width)
+        distance, spread = self.spread(seperation)
+
+        count = self.seen + np.arange(1, keep + 1)
+        self.seen += keep
+        flagged = ((np.abs(distance) > self.sigma * spread) &
+                   (count >= self.warmup))
+        return self.group(time[flagged], distance[flagged], time[-1])
+
+    def spread(self, seperation):
+        """
+        Returns the distance of each seperation from the centre of its
+        window and the spread of that window, keeping the last window of
+        seperations for the next block
+        """
+        old = len(self.seperation)
+        every = pd.Series(np.hstack((self.seperation, seperation)))
+        rolling = every.rolling(self.window, min_periods=1)
+        self.seperation = every.to_numpy()[-self.window+1:]
+
+        if self.method == 'rolling':
+            centre = rolling.mean().to_numpy()[old:]
+            spread = rolling.std(ddof=0).to_numpy()[old:]
+            return seperation - centre, spread
+
+        centre = rolling.median().to_numpy()[old:]
+        deviation = pd.Series(np.hstack((self.deviation,
+                                         np.abs(seperation - centre))))
+        spread = 1.4826 * deviation.rolling(
+            self.window, min_periods=1).median().to_numpy()[old:]
+        self.deviation = deviation.to_numpy()[-self.window+1:]
+        return seperation - centre, spread
+
+    def group(self, time, value, now):
+        """
+        Adds flagged samples to the open span and returns the spans
+        that closed, those that ended more than gap before now
+        """
+        events = cluster_events(time, value, self.gap)
+        if self.event is not None:
+            if len(events) and events[0]['start'] <= (self.event['end'] +
+                                                      self.gap):
+                events[0]['start'] = self.event['start']
+                events[0]['count'] += self.event['count']
+                events[0]['peak'] = max(events[0]['peak'],
+                                        self.event['peak'])
+            else:
+                events = np.hstack((self.event, events))
+            self.event = None
+        if len(events) and events[-1]['end'] + self.gap >= now:
+            self.event = events[-1].copy()
+            events = events[:-1]
+        return events
+
+    def flush(self):
+        """Closes the open span and returns it"""
+        events = np.empty(0, dtype=EVENT_DTYPE)
+        if self.event is not None:
+            events = np.hstack((events, self.event))
+            self.event = None
+        return events
+
+@lru_cache(maxsize=32)
+def design_filter(order, cutoff, original, btype='lowpass'):
+    """ Designs a butterworth filter once per (order, cutoff, original,
+    btype) and returns it as second order sections, which stay stable
+    at orders and cutoffs where the b/a coefficients fall apart
+
+    Args:
+    ----
+        order (int): order of the filter
+        cutoff (float or tuple): the cutoff point(s) in hz
+        original (float): the sampling rate in hz
+        btype (str): lowpass, highpass, bandpass or bandstop
+
+    Returns:
+    -------
+        np.array: (sections, 6) array of the filter, shared between
+            callers so it is read only
+    """
+    sos = signal.butter(order, cutoff, btype=btype, output='sos',
+                        fs=original)
+    sos.setflags(write=False)
+    return sos
 
 def butter_low_pass(data, desired, original, order=5):
-    """ Creates the coefficients for a low pass butterworth
-    filter. That can change data from its original sample rate
-    to a desired sample rate
+    """ Low pass filters data forward and backward with a
+    butterworth filter. That can change data from its original sample
+    rate to a desired sample rate
 
     Args:
     ----
         data (np.array): data to be filtered
-c
         desirerd (int): the cutoff point for data in hz
         original (int): the initial sampling rate in hz
 
     Returns:
     -------
         np.array: of the data after it has been filtered
+     """
+    # design_filter() shares a read only array, sosfilt wants its own
+    sos = np.array(design_filter(order, desired, original))
+    return signal.sosfiltfilt(sos, data, padlen=10)
+
+def settle_length(sos, tol=1e-9):
+    """ Returns how many samples the impulse response of sos takes to
+    fall below tol of its peak, the overlap ChunkedFilter needs for the
+    backward pass to forget where it started """
+    length = 1024
+    while True:
+        impulse = np.zeros(length)
+        impulse[0] = 1
+        response = np.abs(signal.sosfilt(sos, impulse))
+        above = np.nonzero(response > tol * response.max())[0]
+        if above[-1] < length * 3 // 4 or length >= 2**24:
+            return int(above[-1]) + 1
+        length *= 2
+
+class ChunkedFilter():
+    """
+    Zero phase forward-backward filter of a signal that is pushed in
+    blocks, so memory stays constant however long the signal is.
+    Samples run along the last axis, so the blocks of a (4, samples)
+    array filter every channel at once.
+
+    The forward pass is exact, its state is carried from block to
+    block. The backward pass of each block starts overlap samples past
+    its end, far enough that the missing future has decayed away. The
+    ends are padded with an odd extension and start from steady state
+    like signal.sosfiltfilt, so the output matches it. Output lags the
+    input by overlap samples, the rest comes out of flush()
+    """
+    def __init__(self, sos, overlap=None, padlen=10, step=1):
+        """
+        :type sos: numpy array
+        :param sos: second order sections of the filter
+
+        :type overlap: int or None
+        :param overlap: samples held back for the backward pass, None
+                        uses settle_length(sos)
+
+        :type padlen: int
+        :param padlen: samples of odd extension added at both ends
+
+        :type step: int
+        :param step: only every step-th filtered sample is returned
+        """
+        # A writable copy, design_filter() shares a read only array
+        self.sos = np.array(sos)
+        self.overlap = (settle_length(self.sos) if overlap is None
+                        else overlap)
+        self.padlen = padlen
+        self.step = step
+        self.head = None  # input held until the start can be padded
+        self.last = None  # last padlen+1 input samples
+        self.zi = None    # forward state, None before the start
+        self.tail = None  # forward output waiting for the backward pass
+        self.skip = 0     # padded samples still to drop
+        self.position = 0 # index of the next sample returned
+
+    def push(self, block):
+        """ Filters the next block and returns what is ready """
+        block = np.asarray(block, dtype=np.float64)
+        if self.zi is None:
+            self.head = join(self.head, block)
+            if self.head.shape[-1] <= self.padlen:
+                return self.head[..., :0]
+            block, self.head = self.head, None
+            pad = 2*block[..., :1] - block[..., self.padlen:0:-1]
+            block = np.concatenate((pad, block), axis=-1)
+            self.zi = self.steady_state(block[..., 0])
+            self.skip = self.padlen
+            self.last = block[..., -self.padlen-1:].copy()
+        else:
+            self.last = join(self.last, block)[..., -self.padlen-1:]
+
+        forward, self.zi = signal.sosfilt(self.sos, block, zi=self.zi)
+        self.tail = join(self.tail, forward)
+        ready = self.tail.shape[-1] - self.overlap
+        if ready <= 0:
+            return self.tail[..., :0]
+        output = self.backward(self.tail)[..., :ready]
+        self.tail = self.tail[..., ready:].copy()
+        return self.emit(output)
+
+    def flush(self):
+        """ Pads the end of the signal and returns everything left """
+        if self.zi is None:
+            # Too short to pad, sosfiltfilt raises the same error
+            head = np.empty(0) if self.head is None else self.head
+            output = signal.sosfiltfilt(self.sos, head, padlen=self.padlen)
+            self.head = None
+            return self.emit(output)
+
+        pad = 2*self.last[..., -1:] - self.last[..., -2::-1]
+        forward, self.zi = signal.sosfilt(self.sos, pad, zi=self.zi)
+        output = self.backward(join(self.tail, forward))
+        output = output[..., :output.shape[-1]-self.padlen]
+        self.tail = None
+        return self.emit(output)
+
+    def state(self):
+        """ Returns everything needed to carry on filtering later as a
+        dict of arrays, exp: for np.savez. See from_state() """
+        state = {'sos': self.sos,
+                 'settings': np.array([self.overlap, self.padlen,
+                                       self.step, self.skip,
+                                       self.position])}
+        for name in ['head', 'last', 'zi', 'tail']:
+            if getattr(self, name) is not None:
+                state[name] = getattr(self, name)
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """ Rebuilds a ChunkedFilter from what state() returned """
+        overlap, padlen, step, skip, position = (
+            int(value) for value in state['settings'])
+        lowpass = cls(np.array(state['sos']), overlap, padlen, step)
+        lowpass.skip, lowpass.position = skip, position
+        for name in ['head', 'last', 'zi', 'tail']:
+            if name in state:
+                setattr(lowpass, name, np.array(state[name]))
+        return lowpass
+
+    def steady_state(self, first):
+        """ Returns the filter state of a signal that has been at
+        first forever, shaped for sosfilt along the last axis """
+        zi = signal.sosfilt_zi(self.sos)
+        zi = zi.reshape((len(zi),) + (1,)*np.ndim(first) + (2,))
+        return zi * np.asarray(first)[None, ..., None]
+
+    def backward(self, forward):
+        """ Runs the backward pass over forward, from steady state """
+        zi = self.steady_state(forward[..., -1])
+        return signal.sosfilt(self.sos, forward[..., ::-1],
+                              zi=zi)[0][..., ::-1]
+
+    def emit(self, output):
+        """ Drops the start padding and keeps every step-th sample """
+        drop = min(self.skip, output.shape[-1])
+        output, self.skip = output[..., drop:], self.skip - drop
+        first = -self.position % self.step
+        self.position += output.shape[-1]
+        # Copy so the block the samples came from can be freed
+        return output[..., first::self.step].copy()
+
+def join(start, end):
+    """ Joins two blocks along the last axis, start can be None """
+    if start is None:
+        return end
+    return np.concatenate((start, end), axis=-1)
+
+def chunked_low_pass(data, desired, original, order=5, chunk=2**18,
+                     step=1):
+    """ Low pass filters data like butter_low_pass() a chunk at a time
+    so the work space does not grow with the length of data
+
+    Args:
+    ----
+        data (np.array or iterable): data to be filtered along its last
+            axis, or the blocks of it in order
+        desired (float): the cutoff point for data in hz
+        original (float): the initial sampling rate in hz
+        chunk (int): samples filtered at a time when data is an array
+        step (int): only every step-th filtered sample is kept,
+            like [..., ::step]
+
+    Returns:
+    -------
+        np.array: of the data after it has been filtered
+    """
+    sos = design_filter(order, desired, original)
+    lowpass = ChunkedFilter(sos, step=step)
+    blocks = data
+    if isinstance(data, np.ndarray):
+        blocks = (data[..., start:start+chunk]
+                  for start in range(0, data.shape[-1], chunk))
+
+    output = [lowpass.push(block) for block in blocks]
+    output.append(lowpass.flush())
+    return np.concatenate(output, axis=-1)
+
+def decimation_stages(factor, largest=10):
+    """
+    Splits a decimation factor into stages no larger than largest,
+    biggest first. exp: 100 -> [10, 10], 32 -> [8, 4]
+    """
+    primes = []
+    rest, prime = int(factor), 2
+    while rest > 1:
+        while rest % prime == 0:
+            primes.append(prime)
+            rest //= prime
+        prime += 1
+
+    stages = []
+    for prime in sorted(primes, reverse=True):
+        # Put each factor in the first stage it fits in
+        for iterate, stage in enumerate(stages):
+            if stage * prime <= largest:
+                stages[iterate] *= prime
+                break
+        else:
+            stages.append(prime)
+    return sorted(stages, reverse=True) or [1]
 
-    Note:
+@lru_cache(maxsize=None)
+def fir_stage(factor, cutoff, original, length):
+    """
+    Designs the anti-alias filter of one decimation stage, a linear
+    phase kaiser window FIR
+
+    Args:
     ----
-        I find that the filter will make the data all 0's if the order
-    is too high. Not sure if this is my end or scipy.signal. So work with
-    CAUTION
+        factor (int): decimation of the stage
+        cutoff (float): -6dB point of the filter in hz
+        original (float): sampling rate going into the stage in hz
+        length (int): taps per output sample
+    """
+    taps = signal.firwin(length*factor + 1, cutoff, window=('kaiser', 8.0),
+                         fs=original)
+    taps.setflags(write=False)
+    return taps
 
-     """
-    nyq = .5 * original
-    cutoff = desired / nyq
-    var_b, var_a = signal.butter(order, cutoff,
-                                 btype='lowpass',
-                                 analog=False)
-    return signal.filtfilt(var_b, var_a, data, padlen=10)
+def polyphase_plan(factor, desired, original):
+    """
+    Lists the (factor, taps, rate) of every stage used to decimate
+    original by factor with a final cutoff of desired. Only the last
+    stage needs a sharp filter at desired, earlier stages just have to
+    stop what would alias onto the final band so they cut at their
+    output nyquist with a short wide filter
+    """
+    plan = []
+    rate = original
+    stages = decimation_stages(factor)
+    for iterate, stage in enumerate(stages):
+        if iterate == len(stages) - 1:
+            taps = fir_stage(stage, desired, rate, 20)
+        else:
+            taps = fir_stage(stage, rate / stage / 2, rate, 6)
+        plan.append((stage, taps, rate))
+        rate = rate / stage
+    return plan
+
+def polyphase_decimate(data, factor, desired, original):
+    """ Filters and decimates data in polyphase FIR stages, for
+    example 100 -> 10 -> 1 Hz. Each stage only computes the outputs it
+    keeps and the filters are linear phase with their delay removed, so
+    sample k of the output lines up with sample k*factor of the input
+    like data[::factor]
+
+    Args:
+    ----
+        data (np.array): data to be filtered along its last axis
+        factor (int): total decimation
+        desired (float): the cutoff point for data in hz
+        original (float): the initial sampling rate in hz
+
+    Returns:
+    -------
+        np.array: ceil(samples/factor) filtered samples
+    """
+    data = np.asarray(data, dtype=np.float64)
+    for stage, taps, _ in polyphase_plan(factor, desired, original):
+        if stage > 1:
+            data = signal.resample_poly(data, 1, stage, axis=-1,
+                                        window=taps, padtype='line')
+    return data
+
+def polyphase_response(factor, desired, original, worN=4096):
+    """ Returns the anti-alias response of polyphase_decimate() over
+    0 to the original nyquist, the product of the stage responses
+
+    Returns:
+    -------
+        np.array: frequencies in hz
+        np.array: magnitude of the response (1 is unity gain)
+    """
+    freq = np.linspace(0, original/2, worN)
+    response = np.ones(worN)
+    for _, taps, rate in polyphase_plan(factor, desired, original):
+        response *= np.abs(signal.freqz(taps, worN=freq, fs=rate)[1])
+    return freq, response
 
 def resample_data(data, desired):
     """ Takes in a set of data and resamples the data at the
@@ -547,6 +1751,154 @@ def resample_data(data, desired):
     data = data[:desired]
     return data
 
+def format_time(time):
+    """
+    Helper for write_vsec(), the HH:MM:SS:MSS of one time in seconds
+    rounded half up to the millisecond exactly as Decimal does
+    """
+    time = Decimal(time)
+    time = Decimal(time.quantize(Decimal('.001'), rounding=ROUND_HALF_UP))
+    time, mili = divmod(time, 1)
+    minute, second = divmod(time, 60)
+    hour, minute = divmod(minute, 60)
+    hour = hour%24
+    mili = str(mili).split('.')
+    return "%02d:%02d:%02d:%s" % (hour, minute, second, mili[1])
+
+def write_vsec(file_name, date, time, data, mode='w'):
+    """
+    Writes a day of 1hz data in the vsec.sec format, one line per time
+
+        YYYY-MM-DD HH:MM:SS:MSS JJJ    X Y Z F
+
+    Args:
+    ----
+        file_name (str): file to write
+        date (class): date written on every line, uses y, m, d, j
+        time (np.array): seconds of day of each line
+        data (np.array): (4, lines) x, y, z, f values of each line
+        mode (str): 'w' to write a new file or 'a' to add to one
+    """
+    time = np.asarray(time, dtype=np.float64)
+    # Round half up to the millisecond, values that fall too close to
+    # half a millisecond for float math are rounded with Decimal below
+    scaled = time * 1000
+    mili = np.floor(scaled + .5).astype(np.int64)
+    safe = ((np.abs(scaled - np.floor(scaled) - .5) > 1e-6) &
+             (time >= 0) & np.isfinite(time))
+
+    seconds, mili = divmod(mili, 1000)
+    minute, second = divmod(seconds, 60)
+    hour, minute = divmod(minute, 60)
+    hour = hour%24
+
+    line = ('%s-%s-%s %%02d:%%02d:%%02d:%%03d %s    %%.2f %%.2f %%.2f %%.2f\n'
+            %(date.y, date.m, date.d, date.j))
+    lines = [line%(values) for values in zip(
+        hour.tolist(), minute.tolist(), second.tolist(), mili.tolist(),
+        data[0].tolist(), data[1].tolist(),
+        data[2].tolist(), data[3].tolist())]
+    for iterate in np.nonzero(~safe)[0]:
+        lines[iterate] = ('%s-%s-%s %s %s    %.2f %.2f %.2f %.2f\n'
+                          %(date.y, date.m, date.d,
+                            format_time(time[iterate]), date.j,
+                            data[0][iterate], data[1][iterate],
+                            data[2][iterate], data[3][iterate]))
+
+    chunk = 8192 # lines per write
+    with open(file_name, mode) as data_base:
+        for start in range(0, len(lines), chunk):
+            data_base.write(''.join(lines[start:start+chunk]))
+
+def run_stations(target, stations, workers=WORKERS, logger_name=None,
+                 log_file=None):
+    """
+    Used by rt1hz.py, rt1hzVoltTemp.py
+
+    Runs target(loc=station) for every station. The stations share
+    nothing so with more than one worker they are run in a process pool
+    and take about as long as the slowest one.
+
+    Args:
+    ----
+        target (function): module level function taking loc
+        stations (list of str): stations to run
+        workers (int): number of processes, 1 runs them one at a time
+        logger_name (str): logger of the script to move to log_file
+        log_file (str): log file of each station, {loc} is replaced
+            with the station
+
+    Returns:
+    -------
+        dict: station to None if it ran or the traceback if it failed,
+        one failed station does not stop the others
+    """
+    jobs = [(target, loc, logger_name, log_file) for loc in stations]
+    if workers <= 1:
+        return dict(zip(stations, [station_worker(*job) for job in jobs]))
+
+    # fork so the workers start with the script's loggers and globals
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('fork')
+                            ) as pool:
+        futures = [pool.submit(station_worker, *job) for job in jobs]
+        errors = {}
+        for loc, future in zip(stations, futures):
+            try:
+                errors[loc] = future.result()
+            except Exception: # worker process died
+                errors[loc] = traceback.format_exc()
+    return errors
+
+def station_worker(target, loc, logger_name, log_file):
+    """Helper for run_stations(), runs one station. With one worker
+    this runs in the script itself, so the logger gets its own handlers
+    back afterwards"""
+    if log_file:
+        station_log = logging.getLogger(logger_name)
+        saved = list(station_log.handlers)
+        handler = logging.FileHandler(log_file.format(loc=loc), 'w')
+        handler.setFormatter(logging.Formatter(
+            '%(name)s - %(levelname)s - %(message)s'))
+        station_log.handlers = [handler]
+    try:
+        target(loc=loc)
+    except Exception:
+        return traceback.format_exc()
+    finally:
+        if log_file:
+            station_log.handlers = saved
+            handler.close()
+    return None
+
+def prefetch(load, jobs, depth=2):
+    """
+    Used by recordlrt.py
+
+    Loads the next depth jobs in a thread pool while the current one is
+    being worked on, so reading files overlaps with processing them.
+
+    Args:
+    ----
+        load (function): called as load(*job)
+        jobs (list of tuple): arguments of each load, in order
+        depth (int): how many jobs to load ahead of the current one
+
+    Yields:
+    ------
+        (tuple, Future): each job and its load, future.result() returns
+        what load returned or raises what it raised
+    """
+    jobs = iter(jobs)
+    with ThreadPoolExecutor(max_workers=max(depth, 1)) as pool:
+        queue = deque()
+        for job in jobs:
+            queue.append((job, pool.submit(load, *job)))
+            if len(queue) > depth:
+                yield queue.popleft()
+        while queue:
+            yield queue.popleft()
+
 def make_files(year, month, day):
     """
     Makes a file directory for all LRT stations
@@ -19,9 +19,14 @@ confused you can contact me at kovachik.andrew@gmail.com
 # Python packages
 from math import ceil
 import time
+import argparse
 import logging
 import logging.config
 import os.path
+import traceback
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from os.path import expanduser
 import configparser as cp
 # Third party packages
@@ -32,7 +37,7 @@ mpl.use('Agg')
 import matplotlib.pyplot as plt
 import datetime
 # Custom packages
-from formatdata import Data, Date, make_files
+from formatdata import Data, Date, make_files, data_path
 
 
 # Creates logger
@@ -52,6 +57,9 @@ logger = logging.getLogger('graphing')
 
 fmt2 = lambda x: "%02d" % x
 
+# number of processes plots are rendered in, 1 renders them one at a time
+PLOT_WORKERS = config.getint('GRAPH', 'workers', fallback=1)
+
 #------CLASSES----#
 
 class FailedToCollectDataError(Exception):
@@ -124,6 +132,216 @@ class AxisGet():
                                 self.y_max+1,
                                 self.y_max/5) # y ticks
 
+class ReferenceCache():
+    """
+    OTT sec data read once per day and handed out as copies, so the day
+    plots and every hour plot of a day only parse the file once.
+
+    fstar() is run on the day as it is read, make_variance() is left to
+    each plot since it centres on the mean of what is plotted.
+    """
+    def __init__(self, days=2):
+        """
+        :type days: int
+        :param days: number of days kept, the oldest is dropped first
+        """
+        self.days = days
+        self.cache = OrderedDict()
+
+    def get(self, date, direc, hour=None):
+        """
+        Returns the OTT Data of a day or of one hour of it
+
+        :type date: class
+        :param date: contains varying details about the date
+
+        :type direc: string
+        :param direc: directory of the OTT sec files
+
+        :type hour: int or None
+        :param hour: hour wanted, None for the whole day
+        """
+        key = (direc, str(date.y), str(date.j))  # what Data reads
+        if key in self.cache:
+            self.cache.move_to_end(key)
+        else:
+            day = Data('sec', date, 'OTT', direc)
+            day.fstar()
+            self.cache[key] = day
+            while len(self.cache) > self.days:
+                self.cache.popitem(last=False)
+        return self.cache[key].copy(hour)
+
+# OTT days read by this process
+OTT = ReferenceCache()
+
+def min_max_envelope(x, y, columns):
+    """
+    Thins a line to what can be seen of it at a width of columns pixels
+
+    x is split into columns equal bins and only the lowest and highest
+    point of each bin is kept, in the order they came, along with the
+    first and last point. Drawn no wider than columns pixels the line
+    covers the same pixels as the full one, so drawing it takes time set
+    by the width of the figure rather than the length of the data.
+
+    :type x: np.array
+    :param x: increasing x of the line
+
+    :type y: np.array
+    :param y: y of the line
+
+    :type columns: int
+    :param columns: number of pixels the line can be drawn across
+
+    :rtype: (np.array, np.array)
+    :returns: x and y of the points kept, the line itself if it is
+              already short or has gaps (nan) to keep
+    """
+    if len(x) <= 4 * columns or np.isnan(y).any():
+        return x, y
+    edges = np.linspace(x[0], x[-1], columns + 1)[:-1]
+    starts = np.unique(np.searchsorted(x, edges))
+    sizes = np.diff(np.append(starts, len(y)))
+    keep = [[0, len(y) - 1]]
+    for extreme in (np.minimum, np.maximum):
+        value = np.repeat(extreme.reduceat(y, starts), sizes)
+        hits = np.flatnonzero(y == value)
+        keep.append(hits[np.searchsorted(hits, starts)])
+    keep = np.unique(np.concatenate(keep))
+    return x[keep], y[keep]
+
+class FigureTemplate():
+    """
+    A figure with its panels, lines, ticks and legends already laid out.
+
+    Setting up the axes is the same for every plot of a mode so it is
+    done once and each plot only swaps the data of the lines, rescales
+    and saves. Get one with figure_template().
+    """
+    def __init__(self, mode, plots, size):
+        """
+        :type mode: string
+        :param mode: data plotted, 'v32Hz' and 'v100Hz' are hour plots
+
+        :type plots: int
+        :param plots: number of panels, 5 adds F-F*
+
+        :type size: (int, int)
+        :param size: size of the figure in inches
+        """
+        self.axis = AxisGet(mode)
+        self.hourly = mode == 'v32Hz' or mode == 'v100Hz'
+        names = ['X', 'Y', 'Z', 'F*', 'F-F*']
+        scale = 'Min' if self.hourly else 'Hour'
+
+        self.fig, self.axes = plt.subplots(plots, figsize=size)
+        self.fig.text(.5, .04, 'Time(%s)'%(scale), ha='center', va='center')
+        self.title = self.fig.suptitle('', fontsize=20)
+
+        self.roc, self.lrt, self.ott, self.spikes = [], [], [], []
+        for k in range(4):
+            axtwn = self.axes[k].twinx()
+            self.roc += axtwn.plot([], [], 'r-', label='Rate of Change',
+                                   alpha=.3)
+            self.lrt += self.axes[k].plot([], [], 'b-', label=' ')
+            self.ott += self.axes[k].plot([], [], 'c-', label=' ')
+            if self.hourly:
+                self.spikes += self.axes[k].plot([], [], 'gx',
+                                                 markersize=10, alpha=.75)
+
+            self.axes[k].set_xticks(self.axis.x_major)
+            self.axes[k].set_xticks(self.axis.x_minor, minor=True)
+            self.axes[k].grid(which='both')
+            self.axes[k].set_ylabel('%s variance (nT)'%(names[k]))
+            self.axes[k].legend(loc=2, prop={'size':12})
+
+        self.ffstar = None
+        if plots == 5:
+            self.ffstar, = self.axes[4].plot([], [], label='F-F*')
+            self.axes[4].legend(loc=2, prop={'size':12})
+            self.axes[4].grid(which='both')
+
+        # laid out once there are real ticks and labels to fit
+        self.laid_out = False
+        # pixels across the saved figure, more than any line can take up
+        dpi = mpl.rcParams['savefig.dpi']
+        dpi = self.fig.dpi if dpi == 'figure' else dpi
+        self.columns = int(ceil(self.fig.get_figwidth() * dpi))
+
+    def draw(self, title, lrt, ott, lrt_label, ott_label):
+        """
+        Puts the data of a plot into the figure
+
+        :type title: string
+        :param title: title of the figure
+
+        :type lrt: class
+        :param lrt: Data of the site, after fstar, make_rate_change and
+                    make_variance
+
+        :type ott: class
+        :param ott: Data of OTT, after fstar and make_variance
+
+        :type lrt_label: string
+        :param lrt_label: legend name of the site data, {} is its average
+
+        :type ott_label: string
+        :param ott_label: legend name of the OTT data, {} is its average
+        """
+        self.title.set_text(title)
+        for k in range(4):
+            self.roc[k].set_data(*self.thin(lrt.time, lrt.roc[k]))
+            self.lrt[k].set_data(*self.thin(lrt.time, lrt.data[k]))
+            self.lrt[k].set_label(lrt_label.format(lrt.avg[k]))
+            self.ott[k].set_data(*self.thin(ott.time, ott.data[k]))
+            self.ott[k].set_label(ott_label.format(ott.avg[k]))
+            if self.hourly: # every spike is marked, they are not thinned
+                self.spikes[k].set_data(lrt.spikes[k][0],
+                                        lrt.spikes[k][1]-lrt.avg[k])
+
+            # the legend keeps its own copy of the labels
+            legend = self.axes[k].get_legend()
+            legend.get_texts()[0].set_text(self.lrt[k].get_label())
+            legend.get_texts()[1].set_text(self.ott[k].get_label())
+
+            for axes in (self.axes[k], self.roc[k].axes):
+                axes.relim()
+                axes.autoscale_view()
+
+            # y axis scale
+            self.axis.yaxis(lrt.data[k], ott.data[k])
+            self.axes[k].set_yticks(self.axis.y_tick)
+            self.axes[k].set_ylim([-self.axis.y_max, self.axis.y_max])
+
+        if self.ffstar is not None:
+            self.ffstar.set_data(*self.thin(lrt.time, lrt.ffstar()))
+            self.ffstar.axes.relim()
+            self.ffstar.axes.autoscale_view()
+
+    def thin(self, x, y):
+        """Returns the points of a line that can be seen in the figure,
+        see min_max_envelope()"""
+        return min_max_envelope(x, y, self.columns)
+
+    def save(self, path, fmt):
+        """Saves the figure as it is now"""
+        if not self.laid_out:
+            self.fig.tight_layout()
+            self.fig.subplots_adjust(top=0.88)
+            self.laid_out = True
+        self.fig.savefig(path, format=fmt)
+
+# Templates made in this process by (mode, panels)
+TEMPLATES = {}
+
+def figure_template(mode, plots, size):
+    """Returns the FigureTemplate of a mode and number of panels, making
+    it the first time it is asked for"""
+    if (mode, plots) not in TEMPLATES:
+        TEMPLATES[(mode, plots)] = FigureTemplate(mode, plots, size)
+    return TEMPLATES[(mode, plots)]
+
 def plot(mode, loc, date, samp_freq, hour=None, ffstar=False):
     """
     Creates varying types of plots depending on the types specified
@@ -144,7 +362,6 @@ def plot(mode, loc, date, samp_freq, hour=None, ffstar=False):
     :param hour: an int formated to two spaces, used if plotting hours
     """
     config = Config(date, loc, samp_freq, hour)
-    axis = AxisGet(mode)
 
     logger.info('Working on file %s %s-%s-%s, %s',
                 loc, date.y, date.m, date.d, mode)
@@ -155,7 +372,7 @@ def plot(mode, loc, date, samp_freq, hour=None, ffstar=False):
     #----DATA COLLECTION----#
 
     try:
-      ott = Data('sec', date, 'OTT', config.direc('sec', date), hour=hour)
+      ott = OTT.get(date, config.direc('sec', date), hour=hour)
       logger.info('Got OTT data')
     except FileNotFoundError:
         raise FailedToCollectDataError('Could not find: OTT sec data. ' +
@@ -170,10 +387,13 @@ def plot(mode, loc, date, samp_freq, hour=None, ffstar=False):
                                        %(loc, mode) +
                                        '%s\\%s\\%s Hour:%s'
                                        %(date.y, date.m, date.d, hour))
+    if samp_freq == 1:
+        # Compare the same seconds of both, a gap in either drops out
+        ott.align_to(lrt.time, .5/3600)
+
     # Apply all data maniplulation needed
     # TODO: Make options for different data manipulations
-    lrt.fstar()
-    ott.fstar()
+    lrt.fstar() # ott has had fstar() run when it was read
     if isinstance(hour, int): # is hour not None
         lrt.make_smooth(10)
         lrt.get_spikes(sigma=4.0)
@@ -184,90 +404,161 @@ def plot(mode, loc, date, samp_freq, hour=None, ffstar=False):
     logger.info('Reformated Data')
 
     #---PLOT DETAILS---#
-    names = ['X', 'Y', 'Z', 'F*', 'F-F*']
 
     # Different names for axis depending on options given
     if  mode == 'v32Hz' or mode == 'v100Hz':
-        scale, span = 'Min', ('Hour ' + '%02d'%(hour) + '00')
+        span = 'Hour ' + '%02d'%(hour) + '00'
     else:
-        scale, span = 'Hour', 'Whole Day'
+        span = 'Whole Day'
 
     if ffstar:
         plots = 5
     else:
         plots = 4
 
-    # Creating subplots
-    fig, axes = plt.subplots(plots, figsize=config.size)
-    fig.text(.5, .04, 'Time(%s)'%(scale), ha='center', va='center')
-    fig.suptitle(
-        '{0} {1}/{2}/{3} {4} {5}Hz Data'.format(
-            loc, date.y, date.m, date.d, span, samp_freq),
-        fontsize=20
-        )
-
     #---PLOT MAKING---#
     logger.info('Creating plot...')
 
-    for k in range(4):
+    template = figure_template(mode, plots, config.size)
+    template.draw('{0} {1}/{2}/{3} {4} {5}Hz Data'.format(
+                      loc, date.y, date.m, date.d, span, samp_freq),
+                  lrt, ott, loc + ' Data {}', 'OTT Data {}')
+    logger.info('Added plot details')
+
+    #--SAVING PLOT--#
 
-        # Rate of change
-        axtwn = axes[k].twinx()
-        axtwn.plot(lrt.time, lrt.roc[k], 'r-',
-                   label='Rate of Change', alpha=.3)
-        logger.info('Plotter RoC')
+    template.save(config.save, config.fmt)
 
-        # LRT data
-        axes[k].plot(lrt.time, lrt.data[k], 'b-',
-                     label='{} Data {}'.format(loc, lrt.avg[k]))
-        logger.info('Plotted %s', loc)
+    logger.info('Plot completed and saved to %s', config.save)
 
-        # OTT data
-        axes[k].plot(ott.time, ott.data[k], 'c-',
-                     label='{} Data {}'.format('OTT', ott.avg[k]))
-        logger.info('Plotted OTT')
+def plot_worker(job, date):
+    """
+    Renders one plot job, used by render_plots()
 
-        # Spikes if mode is 32hz or 100hz
-        if mode == 'v32Hz' or mode == 'v100Hz':
-            axes[k].plot(lrt.spikes[k][0], lrt.spikes[k][1]-lrt.avg[k],
-                         'gx', markersize=10, alpha=.75)
+    :type job: tuple
+    :param job: (mode, loc, samp_freq, hour, ffstar) arguments of plot
 
-    # F-Fstar if option is desired
-    if ffstar:
-        axes[4].plot(lrt.time, lrt.ffstar(),
-                     label='F-F*')
-        axes[4].legend(loc=2, prop={'size':12})
-        axes[4].grid(which='both')
+    :rtype: (int, str) or None
+    :returns: log level and message if the plot failed, None if it saved
+    """
+    mode, loc, samp_freq, hour, ffstar = job
+    try:
+        plot(mode, loc, date, samp_freq, hour=hour, ffstar=ffstar)
+    except FailedToCollectDataError as err:
+        return logging.ERROR, str(err)
+    except Exception:
+        return logging.ERROR, ('Plot %s %s hour %s failed\n%s'
+                               %(loc, mode, hour, traceback.format_exc()))
+    return None
+
+def render_plots(jobs, date, workers=PLOT_WORKERS):
+    """
+    Renders every plot job of a day, each one once
 
-    # Subplot options
-    for k in range(4):
-        # y axis scale
-        axis.yaxis(lrt.data[k], ott.data[k])
-        axes[k].set_yticks(axis.y_tick)
-        axes[k].set_ylim([-axis.y_max, axis.y_max])
-        axes[k].set_xticks(axis.x_major)
-        axes[k].set_xticks(axis.x_minor, minor=True)
-        axes[k].grid(which='both')
+    With more than one worker the jobs are rendered in a process pool.
+    Every process has its own pyplot figures so this is only done with
+    the Agg backend, which draws without a display. Failures are sent
+    back and logged here so one bad hour does not stop the others.
 
-        # this labels the plots
-        axes[k].set_ylabel('%s variance (nT)'%(names[k]))
+    :type jobs: list of tuple
+    :param jobs: (mode, loc, samp_freq, hour, ffstar) of each plot
 
-        # sets legends
-        axes[k].legend(loc=2, prop={'size':12})
+    :type date: class
+    :param date: contains varying details about the date
 
-        logger.info('Added plot details')
+    :type workers: int
+    :param workers: number of processes to render in
+    """
+    jobs = list(dict.fromkeys(jobs)) # same plot listed twice is made once
+    if workers <= 1 or len(jobs) <= 1 or mpl.get_backend().lower() != 'agg':
+        results = [plot_worker(job, date) for job in jobs]
+    else:
+        # fork so the workers start with the script's loggers and config
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('fork')
+                                ) as pool:
+            futures = [pool.submit(plot_worker, job, date) for job in jobs]
+            results = []
+            for job, future in zip(jobs, futures):
+                try:
+                    results.append(future.result())
+                except Exception: # worker process died
+                    results.append((logging.ERROR,
+                                    'Plot %s %s hour %s failed\n%s'
+                                    %(job[1], job[0], job[3],
+                                      traceback.format_exc())))
+    for result in results:
+        if result:
+            logger.log(*result)
+
+def plot_files(job, date):
+    """
+    Returns the png a plot job saves and the data files it is made from
 
-    #--SAVING PLOT--#
+    :type job: tuple
+    :param job: (mode, loc, samp_freq, hour, ffstar) arguments of plot
 
-    plt.tight_layout()
-    fig.subplots_adjust(top=0.88)
+    :rtype: (str, list of str)
+    """
+    mode, loc, samp_freq, hour, _ = job
+    config = Config(date, loc, samp_freq, hour)
+    return config.save, [data_path(mode, date, loc,
+                                   config.direc(mode, date), hour),
+                         data_path('sec', date, 'OTT',
+                                   config.direc('sec', date))]
+
+def is_current(output, inputs):
+    """True if output was saved after every input last changed, a
+    missing input is left for plot to report"""
+    try:
+        saved = os.path.getmtime(output)
+        return all(os.path.getmtime(data) <= saved for data in inputs)
+    except OSError:
+        return False
 
-    plt.savefig(config.save, format=config.fmt)
-    plt.close('all')
+def plan_plots(date, records_file):
+    """
+    Works out the plots of a day, the day plot of every station and an
+    hour plot for each station and hour in the lrtRecords file
 
-    logger.info('Plot completed and saved to %s', config.save)
+    :type date: class
+    :param date: contains varying details about the date
+
+    :type records_file: string
+    :param records_file: lrtRecords file made by recordlrt.py
 
-def __auto__(xback=2):
+    :rtype: (list of tuple, list of tuple)
+    :returns: (mode, loc, samp_freq, hour, ffstar) of the plots to make
+              and of those already saved since their data changed
+    """
+    jobs = [('secNew', loc, 1, None, True)
+            for loc in ['LRE', 'LRO', 'LRS']]
+    if os.path.isfile(records_file):
+        records = pd.read_csv(records_file, sep=' ')
+        # One plot for each station and hour, however many rows it has
+        records = records[['LOC', 'HH']].drop_duplicates()
+        jobs += [('v32Hz', str(loc), 32, int(hour), False)
+                 for loc, hour in records.itertuples(index=False)]
+    else:
+        logger.error('FailedToCollectDataError: Could not find "%s"',
+                     records_file)
+
+    todo, current = [], []
+    for job in dict.fromkeys(jobs):
+        if is_current(*plot_files(job, date)):
+            current.append(job)
+        else:
+            todo.append(job)
+    return todo, current
+
+def __auto__(xback=2, dry_run=False):
+    """
+    Plots every day from the one in lastday.txt up to xback days ago,
+    plots saved since their data last changed are not made again
+
+    :type dry_run: bool
+    :param dry_run: only print the plots that would be made or skipped
+    """
     with open(USER+BASE+'/log/lastday.txt') as f:
         data = f.readlines()[0]
         lst = data.split("-")
@@ -285,53 +576,42 @@ def __auto__(xback=2):
         start_time = time.time()
 
         # creates file directory for plots
-        make_files(cdate.y,
-                cdate.m,
-                cdate.d
-                )
-
-        #---DAYPLOT---#
-        for loc in ['LRE', 'LRO', 'LRS']:
-            try:
-                plot('secNew', loc, cdate, 1, ffstar=True)
-
-            except FailedToCollectDataError as err:
-                logger.error(err)
-        #---HOURPLOT---#
-        try:
-            hourly_times_file = (USER + BASE+'/lrtRecords/lrtRecords%s%s.txt'
-                %(cdate.m, cdate.d))
-            if os.path.isfile(hourly_times_file):
-                hourly_times = pd.read_csv(hourly_times_file, sep=' ')
-                hourly_times.drop(['YYYY', 'MM', 'DD', 'MI', 'D', 'MAG'], axis=1)
-                # All that remains is HH and LOC
-                hourly_times.drop_duplicates()
-            else:
-                raise FailedToCollectDataError('FailedToCollectDataError: ' +
-                                            'Could not find "%s"'
-                                            %hourly_times_file)
-        except FailedToCollectDataError as err:
-            logger.error(err)
-
-        else:
-            for iterate in range(len(hourly_times)):
-                try:
-                    plot('v32Hz',
-                        hourly_times.iloc[iterate].LOC,
-                        cdate,
-                        32,
-                        hour=int(hourly_times.iloc[iterate].HH)
-                        )
-                except FailedToCollectDataError as err:
-                    logger.error(err)
+        if not dry_run:
+            make_files(cdate.y,
+                    cdate.m,
+                    cdate.d
+                    )
+
+        hourly_times_file = (USER + BASE+'/lrtRecords/lrtRecords%s%s.txt'
+            %(cdate.m, cdate.d))
+        jobs, current = plan_plots(cdate, hourly_times_file)
+        if dry_run:
+            for job in jobs:
+                print('plot %s'%(plot_files(job, cdate)[0]))
+            for job in current:
+                print('skip %s'%(plot_files(job, cdate)[0]))
+            lastday += delta
+            continue
+
+        logger.info('%s plots to make, %s up to date',
+                    len(jobs), len(current))
+        render_plots(jobs, cdate)
 
         print('--- %s seconds ---'%(time.time() - start_time))
         lastday += delta
-    
+
+    if dry_run:
+        return
     with open(USER+BASE+'/log/lastday.txt', 'w') as f:
         f.write(date_log.d+"-"+date_log.m+"-"+date_log.y)
 
 if __name__ == "__main__":
-    __auto__()
+    parser = argparse.ArgumentParser(
+        description='Plots the days since the last run and their flagged hours')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='list the plots that would be made or skipped '
+                             'without making them')
+    args = parser.parse_args()
+    __auto__(dry_run=args.dry_run)
     
     
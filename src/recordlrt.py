@@ -18,7 +18,8 @@ import datetime
 # Third Party Packages
 import numpy as np
 # Custom Packages
-from formatdata import Data, Date, get_std_dev
+from formatdata import (Data, Date, get_std_dev, prefetch, cluster_events,
+                        SpikeDetector)
 
 # Creates logger
 USER = expanduser('~')
@@ -48,6 +49,13 @@ class Config(): #customization options
         self.save = USER+BASE+"/lrtRecords/"
         self.lrt_dir = LRT_PATH+self.config.get('RECORD', 'lrt_dir')
         self.dir = None
+        # number of hour files read ahead of the one being checked
+        self.prefetch = self.config.getint('RECORD', 'prefetch', fallback=2)
+        # hourly, rolling or mad, see SpikeDetector
+        self.detector = self.config.get('RECORD', 'detector',
+                                        fallback='hourly')
+        self.window = self.config.getfloat('RECORD', 'detector_window',
+                                           fallback=600)
 
     def direc(self, loc):
         """ Creates a directory for the location specified"""
@@ -55,6 +63,19 @@ class Config(): #customization options
         self.loc = loc
         self.dir = (self.lrt_dir.format(self.loc, self.date.y))
 
+    def load(self, loc, hour):
+        """ Reads the 32hz data of an hour for the location specified"""
+        return Data('v32Hz', self.date, loc,
+                    self.lrt_dir.format(loc, self.date.y), hour=fmt2(hour))
+
+    def detectors(self):
+        """ Returns a streaming spike detector for each channel or None
+        when every hour is checked on its own """
+        if self.detector == 'hourly':
+            return None
+        return [SpikeDetector(self.samp_freq, self.window, 4.0,
+                              self.detector) for _ in range(4)]
+
 
 def main(xback=2):
     """
@@ -84,8 +105,13 @@ def main(xback=2):
         with open(file_name, 'w', 1) as data_base:
             data_base.write('YYYY MM DD HH MI LOC D MAG\n')
 
+        hours = prefetch(cfg.load, [(loc, hour)
+                                    for loc in ['LRE', 'LRO', 'LRS']
+                                    for hour in range(24)], cfg.prefetch)
         for loc in ['LRE', 'LRO', 'LRS']:
+            detectors = cfg.detectors()
             for hour in range(24):
+                _, loading = next(hours)
                 try:
                     cfg.direc(loc)
 
@@ -93,17 +119,26 @@ def main(xback=2):
                                 loc, cdate.y, cdate.m,
                                 cdate.d, fmt2(hour), group)
 
-                    data = Data('v32Hz', cfg.date, cfg.loc,
-                                cfg.dir, hour=fmt2(hour))
-
-                    data.make_smooth(time)
-                    rough = data.raw 
-                    smooth = data.data
+                    data = loading.result()
 
                     logger.info('Opened file %s%s%s%s[%s]v%sHz.tdms',
                                 loc, cdate.y, cdate.m,
                                 cdate.d, fmt2(hour), group)
 
+                    if detectors:
+                        # Spans carry on into the next hour
+                        sec_of_day = (data.time + hour*60)*60
+                        for channel in range(4):
+                            record_events(
+                                detectors[channel].push(sec_of_day,
+                                                        data.raw[channel]),
+                                loc, cdate, channel, file_name)
+                        continue
+
+                    data.make_smooth(time)
+                    rough = data.raw 
+                    smooth = data.data
+
                     for channel in range(4):
                         spikes = get_std_dev(
                             rough[channel],
@@ -112,25 +147,33 @@ def main(xback=2):
                         )
 
                         if np.any(spikes):
-                            record_data(spikes[0], loc, cdate, 
-                                        fmt2(hour), channel, file_name)
+                            record_data(spikes[0], loc, cdate,
+                                        fmt2(hour), channel, file_name,
+                                        values=spikes[1])
 
                 except FileNotFoundError:
                     logger.warning('File Not Found %s%s%s%s[%s]v%sHz.tdms \
                             Continuing to next file. ',
                                 loc, cdate.y, cdate.m, cdate.d, fmt2(hour), group)
+                    detectors = flush_detectors(detectors, cfg, loc, cdate,
+                                                file_name)
 
                 except ValueError:
                     logger.error('File is corrupted empty or missing array \
                             for data %s%s%s%s[%s]v%sHz.tdms. ',
                                 loc, cdate.y, cdate.m,
                                 cdate.d, fmt2(hour), group)
+                    detectors = flush_detectors(detectors, cfg, loc, cdate,
+                                                file_name)
                 except:
+                    hours.close()
                     raise
+            flush_detectors(detectors, cfg, loc, cdate, file_name)
+        hours.close()
         lastday += delta
 
 
-def record_data(data, loc, date, hour, channel, file_name):
+def record_data(data, loc, date, hour, channel, file_name, values=None):
     """
     Goes through data and records info if there is a high
     amount of points beyond standard deviation
@@ -150,6 +193,12 @@ def record_data(data, loc, date, hour, channel, file_name):
     :type channel: int
     :param channel: refers to the direction (i.e. channel) being looked at
                     0 being x, 1 being y, 2 being z, 3 being f
+
+    :type values: numpy array or None
+    :param values: value of each spike, used for the peak of each event
+
+    :rtype: numpy array of EVENT_DTYPE
+    :returns: every event found, including those too small to record
     """
 
     logger.debug(file_name)
@@ -160,35 +209,68 @@ def record_data(data, loc, date, hour, channel, file_name):
     logger.debug('Checking %s %s %s %s %s %s ',
                  date.y, date.m, date.d, hour, loc, signal[channel])
 
-    while np.any(data):
-        logger.debug(len(data))
+    events = cluster_events(data, values)
+    rows = []
+    for event in events[events['count'] >= 99]:
+        time_start = event['start']
+        logger.debug(
+            '%s %s %s %s %s %s %s %s ',
+            date.y, date.m, date.d, hour, fmt2(time_start/60),
+            loc, signal[channel], event['count'])
+        rows.append("%s %s %s %s %s %s %s %s\n"
+                    %(date.y, date.m, date.d, hour,
+                      fmt2(time_start/60), loc,
+                      signal[channel], event['count']))
+
+    if rows:
+        with open(file_name, 'a') as data_base:
+            data_base.writelines(rows)
+    return events
 
-        time_start = data[0]
-        time_now = time_start
-        count = 1
+def record_events(events, loc, date, channel, file_name):
+    """
+    Records the spans found by a SpikeDetector that had a high amount
+    of points beyond the spread of their window
 
-        for iterate in range(1, len(data)):
-            if data[iterate] <= (time_now + 1.5):
-                count += 1
-                time_now = data[iterate]
+    :type events: numpy array of EVENT_DTYPE
+    :param events: spans with start and end in seconds of day
 
-        if count >= 99:
-            logger.debug(
-                '%s %s %s %s %s %s %s %s ',
-                date.y, date.m, date.d, hour, fmt2(time_start/60),
-                loc, signal[channel], count)
+    :type loc: str
+    :param loc: location that is being searched through
 
-            with open(file_name, 'a', 1) as data_base:
-                data_base.write(
-                    "%s %s %s %s %s %s %s %s\n"
-                    %(date.y, date.m, date.d, hour,
-                      fmt2(time_start/60), loc,
-                      signal[channel], count)
-                    )
-        for iterate in range(count):
-            if not np.any(data):
-                break
-            data = np.delete(data, 0, 0)
+    :type date: class
+    :param date: hold all values of the current date
+
+    :type channel: int
+    :param channel: refers to the direction (i.e. channel) being looked at
+                    0 being x, 1 being y, 2 being z, 3 being f
+    """
+    signal = ['X', 'Y', 'Z', 'F']
+    rows = ["%s %s %s %s %s %s %s %s\n"
+            %(date.y, date.m, date.d, fmt2(event['start']//3600),
+              fmt2(event['start']%3600//60), loc, signal[channel],
+              event['count'])
+            for event in events[events['count'] >= 99]]
+    for row in rows:
+        logger.debug(row.strip())
+
+    if rows:
+        with open(file_name, 'a') as data_base:
+            data_base.writelines(rows)
+
+def flush_detectors(detectors, cfg, loc, date, file_name):
+    """
+    Records the spans still open in detectors, used at the end of the
+    day and where files are missing so spans do not bridge the gap
+
+    :rtype: list of SpikeDetector or None
+    :returns: new detectors to carry on with
+    """
+    if not detectors:
+        return detectors
+    for channel, detector in enumerate(detectors):
+        record_events(detector.flush(), loc, date, channel, file_name)
+    return cfg.detectors()
 
 if __name__ == '__main__':
     main()
@@ -6,13 +6,18 @@ This file will search through LRT folders and create a text file for
 the 1hz real time data. This data is created by taking the 32hz data
 filtering it to 1hz and then resampling that data to 1hz
 """
+import argparse
 import logging
 import logging.config
 import os.path
+import tempfile
 from datetime import timedelta
 import datetime
-from decimal import Decimal, ROUND_HALF_UP
-from formatdata import MakeData, Date, Data
+from math import ceil
+import numpy as np
+from formatdata import (MakeData, Date, Data, write_vsec, EDGE_PAD,
+                        run_stations, GetTdms, tdms_path, TDMS_CHANNELS,
+                        ChunkedFilter, design_filter, align_times)
 from correctrotation import find_best_scalar, find_best_tri_rot
 import configparser
 
@@ -24,6 +29,8 @@ BASE = config['PATHS']['file_directory']
 IS_DEV = config['DEV']['is_dev']
 LRT_PATH = config['PATHS']['lrt_file_directory']
 SAVE_DIR = config['GRAPH']['secNew_dir']
+STATE_DIR = USER + config.get('INCREMENTAL', 'state_dir',
+                              fallback=BASE + '/rt1hzState')
 # Creates logger
 date = Date(0)
 if IS_DEV == "True":
@@ -53,7 +60,6 @@ def main(loc='LRE', xback=2):
   delta = timedelta(1)
   
   
-  data = MakeData() # start data class
   procDate = Date(xback)
   if IS_DEV == "True":
     procDate.y="2020"
@@ -64,6 +70,7 @@ def main(loc='LRE', xback=2):
   
   while lastday <= procDate.dateObj and not (lastday > procDate.dateObj):
     #-----COLLECT DATA------#
+    data = MakeData() # start data class, time is seconds from lastday
   
     # PREVIOUS DAY
     hour = '23'
@@ -72,11 +79,10 @@ def main(loc='LRE', xback=2):
     [dayObj.y, dayObj.m, dayObj.d] = [cdate.year, cdate.month, cdate.day]
     
     try:
-      data.add_tdms(loc, dayObj, hour)
-      chop1 = len(data.data[0]) # used for removing extra days later
+      data.add_tdms(loc, dayObj, hour, time_window=(86400-EDGE_PAD, 86400),
+                    offset=-86400)
       logger.info('Got previous Day')
     except FileNotFoundError:
-      chop1 = len(data.data[0])
       logger.warning('FailedToCollectDataError: ' + 'File for {}/{}/{} hour: {} location: {} not found'.format(dayObj.y, dayObj.m, dayObj.d, hour, loc))
   
     # MAIN DAY
@@ -92,17 +98,15 @@ def main(loc='LRE', xback=2):
         logger.warning('FailedToCollectDataError: ' + 'File for {}/{}/{} hour: {} location: {} not found'.format(dayObj.y, dayObj.m, dayObj.d, hour, loc))
   
     # NEXT DAY
-    temp = len(data.data[0])
     hour = '00'
     cdate = lastday+timedelta(1)
     dayObj = Date(1)
     [dayObj.y, dayObj.m, dayObj.d] = [cdate.year, cdate.month, cdate.day]
     try:
-      data.add_tdms(loc, dayObj, hour)
-      chop2 = len(data.data[0]) - temp
+      data.add_tdms(loc, dayObj, hour, time_window=(0, EDGE_PAD),
+                    offset=86400)
       logger.info('Got next Day')
     except FileNotFoundError:
-      chop2 = len(data.data[0]) - temp
       logger.warning('FailedToCollectDataError: ' + 'File for {}/{}/{} hour: {} location: {} not found'.format(dayObj.y, dayObj.m, dayObj.d, hour, loc))
       
   
@@ -112,13 +116,13 @@ def main(loc='LRE', xback=2):
                        len(data.data[2]), data.data[2]))
 
     try:
-      sizebefore = len(data.time)
-      data.filtsample(.5, 1*60*60*26, 100)
-      sizeafter = len(data.time)
-    
-      chop1 = int(round(chop1*sizeafter/sizebefore))
-      chop2 = int(round(chop2*sizeafter/sizebefore))
-      data.chop(chop1, chop2)
+      for gap in data.gaps():
+        logger.warning('No data from %.2fs to %.2fs', gap['start'], gap['end'])
+
+      data.filtsample(.5, int(ceil(len(data.time)/100)), 100)
+      # Drop the padding from the days either side by time, so a
+      # missing hour does not move where the day starts or ends
+      data.trim(0, 86400)
     
       #print('Filtered Length: ' + str(len(data.time)))
       #ott = Data('sec', procDate, 'OTT', 
@@ -158,29 +162,8 @@ def main(loc='LRE', xback=2):
                   %(loc,dayObj.y,loc,dayObj.y,int(dayObj.m),int(dayObj.d)))
     logger.debug(file_name)
   
-    with open(file_name, 'w', 1) as data_base:
-      logger.debug('Making database for day')
-      for iterate, time in enumerate(data.time):
-        time = Decimal(time)
-        time = Decimal(time.quantize(Decimal('.001'), rounding=ROUND_HALF_UP))
-        time, mili = divmod(time, 1)
-        minute, second = divmod(time, 60)
-        hour, minute = divmod(minute, 60)
-        hour = hour%24
-        mili = str(mili).split('.')
-        time = "%02d:%02d:%02d:%s" % (hour, minute, second, mili[1])
-        data_base.write('%s-%s-%s %s %s    %s %s %s %s\n'
-        %(
-                                  dayObj.y,
-                                  dayObj.m,
-                                  dayObj.d,
-                                  time,
-                                  dayObj.j,
-                                  '%.2f'%data.data[0][iterate],
-                                  '%.2f'%data.data[1][iterate],
-                                  '%.2f'%data.data[2][iterate],
-                                  '%.2f'%data.data[3][iterate])
-                            )
+    logger.debug('Making database for day')
+    write_vsec(file_name, dayObj, data.time, data.data)
   
     logger.info('Done')
     #except:
@@ -188,7 +171,199 @@ def main(loc='LRE', xback=2):
     lastday += delta
     
 
+#----INCREMENTAL----#
+
+# Hour slots of a day, -1 is hour 23 of the day before and 24, 25 are
+# hours 00, 01 of the day after. The last is only looked for
+DONE = 25
+
+def day_obj(day):
+    """Returns a Date for a datetime.date"""
+    dayObj = Date(0)
+    dayObj.y, dayObj.m, dayObj.d = str(day.year), fmt2(day.month), fmt2(day.day)
+    dayObj.j = fmt3(day.timetuple().tm_yday)
+    return dayObj
+
+def slot_file(loc, day, slot):
+    """
+    Returns where an hour slot of day is read from
+
+    :rtype: (Date, str, (float, float) or None, float)
+    :returns: date and hour of the file, time window read and seconds
+              added to its 'sec of day' to make it relative to day
+    """
+    if slot == -1:
+        return day_obj(day - timedelta(1)), '23', (86400-EDGE_PAD, 86400), -86400
+    if slot >= 24:
+        return day_obj(day + timedelta(1)), fmt2(slot-24), (0, EDGE_PAD), 86400
+    return day_obj(day), fmt2(slot), None, 0
+
+def read_slot(loc, day, slot):
+    """
+    Reads an hour slot of 100hz data
+
+    :rtype: (np.array, np.array) or None
+    :returns: seconds since the start of day and (4, samples) data, None
+              if the file is not there
+    """
+    dayObj, hour, window, offset = slot_file(loc, day, slot)
+    try:
+        group = GetTdms(loc, dayObj, hour, channels=TDMS_CHANNELS,
+                        time_window=window).file['v100Hz']
+    except FileNotFoundError:
+        return None
+    data = np.array([group['channel %s'%(iterate+1)].data
+                     for iterate in range(4)])
+    return group['sec of day'].data + offset, data
+
+def arrived_after(loc, day, slot):
+    """True if a file after an hour slot is there, so a missing slot
+    will not be coming"""
+    for later in range(slot + 1, DONE + 1):
+        dayObj, hour, _, _ = slot_file(loc, day, later)
+        if os.path.isfile(tdms_path(loc, dayObj, hour)):
+            return True
+    return False
+
+def add_ppm(loc, dayObj, time, data):
+    """Puts the v1sec ppm f values into data[3] where its times match"""
+    try:
+        group = GetTdms(loc, dayObj, None, ppm=True,
+                        channels=['channel 1', 'sec of day']).file['v1sec']
+    except FileNotFoundError:
+        return
+    found = align_times(time, group['sec of day'].data)
+    match = found >= 0
+    data[3][match] = group['channel 1'].data[found[match]]
+
+def save_state(state_file, lowpass, times, progress):
+    """Writes the state of a day, replacing the old one in one step"""
+    state = {'times': times, 'progress': np.array(progress)}
+    state.update(lowpass.state())
+    handle, temp = tempfile.mkstemp(dir=STATE_DIR, suffix='.npz')
+    with os.fdopen(handle, 'wb') as saved:
+        np.savez(saved, **state)
+    os.replace(temp, state_file)
+
+def extend_day(loc, day):
+    """
+    Adds the hours of day that arrived since the last run to its 1hz
+    vsec.sec file.
+
+    The 100hz data is pushed through the same 0.5hz filter main() uses
+    a block at a time. The filter state, the times of the samples it
+    still holds and how far the day got are saved in STATE_DIR, so each
+    run only reads the new hours. Samples come out about 20s behind the
+    data read, the rest of the day is written once hour 00 of the next
+    day pads the end. A missing hour is skipped once a later one is
+    there, like main() does. The state is removed once the day is
+    complete, a file with no state is taken as done.
+
+    :type day: datetime.date
+    :param day: day of the file
+
+    :rtype: bool
+    :returns: True once the day is complete
+    """
+    dayObj = day_obj(day)
+    file_name = (LRT_PATH+'/%s/RT1Hz/%s/%s%s%svsec.sec'
+                 %(loc, dayObj.y, loc, dayObj.y, dayObj.m + dayObj.d))
+    state_file = STATE_DIR + '/%s%s%s%s.npz'%(loc, dayObj.y, dayObj.m,
+                                               dayObj.d)
+    os.makedirs(STATE_DIR, exist_ok=True)
+
+    if os.path.isfile(state_file):
+        with np.load(state_file) as saved:
+            state = dict(saved)
+        slot, count, size = (int(value) for value in state['progress'])
+        if slot > DONE:
+            os.remove(state_file)
+            return True
+        lowpass = ChunkedFilter.from_state(state)
+        times = state['times']
+        if os.path.isfile(file_name):
+            # Drops lines written after the state was last saved
+            os.truncate(file_name, size)
+    elif os.path.isfile(file_name):
+        # Made whole by an earlier run or by main()
+        return True
+    else:
+        slot, count, size = -1, 0, 0
+        lowpass = ChunkedFilter(design_filter(5, .5, 100), step=100)
+        times = np.empty(0)
+        # Saved before the file is started so it is never left without one
+        save_state(state_file, lowpass, times, (slot, count, size))
+
+    while slot <= DONE:
+        if slot == DONE:
+            # The next day never padded the end, there is nothing to
+            # filter if no hour of the day ever came
+            data = lowpass.flush() if count else np.empty((4, 0))
+        else:
+            block = read_slot(loc, day, slot)
+            if block is None:
+                if not arrived_after(loc, day, slot):
+                    logger.info('%s %s waiting on hour slot %s',
+                                loc, day, slot)
+                    break
+                logger.warning('Hour slot %s of %s for %s is missing, '
+                               'skipped', slot, day, loc)
+                slot += 1
+                continue
+
+            time, data = block
+            times = np.hstack((times, time[-count % 100::100]))
+            count += len(time)
+            data = lowpass.push(data)
+            if slot == DONE - 1:
+                data = np.hstack((data, lowpass.flush()))
+                slot = DONE
+        slot += 1
+
+        time, times = times[:data.shape[1]], times[data.shape[1]:]
+        keep = (time >= 0) & (time < 86400)
+        if np.any(keep):
+            time, data = time[keep], data[:, keep]
+            add_ppm(loc, dayObj, time, data)
+            write_vsec(file_name, dayObj, time, data,
+                       mode='a' if size else 'w')
+            size = os.path.getsize(file_name)
+        if slot > DONE:
+            os.remove(state_file)
+        else:
+            save_state(state_file, lowpass, times, (slot, count, size))
+
+    logger.info('%s %s extended to slot %s', loc, day, slot)
+    return slot > DONE
+
+def incremental(loc='LRE'):
+    """
+    Extends the 1hz files of yesterday and today with the hours that
+    have arrived, meant to be run every hour
+    """
+    today = datetime.date.today()
+    if IS_DEV == "True":
+        today = datetime.date(2020, 4, 26)
+    for day in [today - timedelta(1), today]:
+        # A day that fails does not stop the other one
+        try:
+            extend_day(loc, day)
+        except Exception:
+            logger.exception('Could not extend %s %s', loc, day)
+
+
 if __name__ == '__main__':
-    for place in ['LRE','LRS','LRO']:
-        main(loc=place)
+    parser = argparse.ArgumentParser(
+        description='Creates the 1hz vsec.sec files from the 100hz data')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only add the hours that arrived since the '
+                             'last run instead of the whole day two days ago')
+    args = parser.parse_args()
+    errors = run_stations(incremental if args.incremental else main,
+                          ['LRE','LRS','LRO'], logger_name='rt1hz',
+                          log_file=(USER + BASE + '/log/rt1hz/rt1hz{loc}%s%s.log'
+                                    %(date.m, date.d)))
+    for place, err in errors.items():
+      if err:
+        logger.error('%s failed: %s', place, err)
 
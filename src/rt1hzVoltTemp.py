@@ -15,7 +15,8 @@ import logging
 import logging.config
 import sys
 import os.path
-from formatdata import MakeData, Date, Data
+from math import ceil
+from formatdata import MakeData, Date, Data, write_vsec, EDGE_PAD, run_stations
 from correctrotation import find_best_scalar, find_best_tri_rot
 from datetime import datetime,date,timedelta
 
@@ -56,8 +57,8 @@ def main(loc='LRE'):
     # PREVIOUS DAY
     try:
         hour = '23'
-        data.add_tdms(loc, prevDay, hour, voltTemp=True)
-        chop1 = len(data.data[0]) # used for removing extra days later
+        data.add_tdms(loc, prevDay, hour, voltTemp=True,
+                      time_window=(86400-EDGE_PAD, 86400), offset=-86400)
         logger.info('Got previous Day')
 
     except FileNotFoundError:
@@ -90,12 +91,9 @@ def main(loc='LRE'):
 
     # NEXT DAY
     try:
-        temp = len(data.data[0])
-
         hour = '00'
-        data.add_tdms(loc, nextDay, hour, voltTemp=True)
-
-        chop2 = len(data.data[0]) - temp
+        data.add_tdms(loc, nextDay, hour, voltTemp=True,
+                      time_window=(0, EDGE_PAD), offset=86400)
         logger.info('Got next Day')
 
 
@@ -110,12 +108,9 @@ def main(loc='LRE'):
                  'Length: {}'.format(len(data.data[1])) + '\n' +
                  'Time: {}'.format(data.time) + '\n' +
                  'Data: {}'.format(data.data[1]))
-    sizebefore = len(data.time)
-    data.filtsample(.5, 1*60*60*26, 32)
-    sizeafter = len(data.time)
-    chop1 = int(round(chop1*sizeafter/sizebefore))
-    chop2 = int(round(chop2*sizeafter/sizebefore))
-    data.chop(chop1, chop2)
+    data.filtsample(.5, int(ceil(len(data.time)/32)), 32, method='chunked')
+    # time runs on from the day before, so the padding is cut by time
+    data.trim(0, 86400)
 
     logger.info('After filtering \n' +
                  'Length: {}'.format(len(data.data[1])) + '\n' +
@@ -136,35 +131,9 @@ def main(loc='LRE'):
     file_name = (USER + '/lrt/' +
                  '%s/RT1HzVoltTemp/%s/%s%s%s%svsecVoltTemp.sec'
                  %(loc,procDate.y, loc, procDate.y, procDate.m, procDate.d))
-    from decimal import Decimal, ROUND_HALF_UP
-
-    with open(file_name, 'w', 1) as data_base:
-        logger.debug('Making database for day')
-        for iterate, time in enumerate(data.time):
-            
-            time = Decimal(time)
-            time = Decimal(time.quantize(Decimal('.001'),
-                                             rounding=ROUND_HALF_UP))
-            time, mili = divmod(time, 1)
-            minute, second = divmod(time, 60)
-            hour, minute = divmod(minute, 60)
-            hour = hour%24
-            
-            mili = str(mili).split('.')
-            time = "%02d:%02d:%02d:%s" % (hour, minute, 
-                                        second, mili[1])
-            data_base.write('%s-%s-%s %s %s    %s %s %s %s\n'
-                            %(
-                                procDate.y,
-                                procDate.m,
-                                procDate.d,
-                                time,
-                                procDate.j,
-                                '%.2f'%data.data[0][iterate],
-                                '%.2f'%data.data[1][iterate],
-                                '%.2f'%data.data[2][iterate],
-                                '%.2f'%data.data[3][iterate])
-                           )
+
+    logger.debug('Making database for day')
+    write_vsec(file_name, procDate, data.time, data.data)
 
     logger.info('Done')
 
@@ -185,11 +154,10 @@ if __name__ == '__main__':
         procDate.y, procDate.m, procDate.d))
     logging.config.fileConfig(USER + '/lrtOps/git/crio-data-reduction/logging.conf')
     logger = logging.getLogger('rt1hzVoltTemp')
-    for place in ['LRO','LRE','LRS']:
-        try:
-            main(loc=place)
-        except FailedToCollectDataError as err:
-            logger.error(err)
-        except:
-            raise
+    errors = run_stations(main, ['LRO','LRE','LRS'], logger_name='rt1hzVoltTemp',
+                          log_file=(USER + '/lrtOps/git/crio-data-reduction/log/rt1hzVoltTemp/rt1hzVoltTemp{loc}%s%s%s.log'
+                                    %(procDate.y, procDate.m, procDate.d)))
+    for place, err in errors.items():
+        if err:
+            logger.error('%s failed: %s', place, err)
 